@@ -1,5 +1,18 @@
 import boto3
+import json
 import re
+import threading
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+
+CREATE_TAGS_BATCH = 1000  # CreateTags accepts up to 1000 resource IDs per request
+VOLUME_LOOKUP_BATCH = 200  # volume-id filter values per DescribeVolumes call
+SNAPSHOT_CHUNK = 1000  # snapshots whose volumes are looked up together
+# KMS quota is shared with production encrypt/decrypt traffic, so back off client-side when throttled
+KMS_CONFIG = Config(retries={'mode': 'adaptive', 'max_attempts': 10})
 
 def get_tag(tags, key):
     for tag in tags:
@@ -7,7 +20,7 @@ def get_tag(tags, key):
             return tag['Value']
     return None
 
-def add_output(output, resource_type, resource_id, tenant_value, status, **kwargs):
+def make_entry(resource_type, resource_id, tenant_value, status, **kwargs):
     entry = {
         "ResourceType": resource_type,
         "ResourceId": resource_id,
@@ -15,249 +28,842 @@ def add_output(output, resource_type, resource_id, tenant_value, status, **kwarg
         "Status": status
     }
     entry.update(kwargs)
-    output.append(entry)
+    return entry
 
-def lambda_handler(event, context):
-    ec2 = boto3.client('ec2')
-    kms = boto3.client('kms', region_name='us-east-1')
-    route53 = boto3.client('route53')
-    output = []
+def iter_pages(client, operation, result_key, **kwargs):
+    # Yield items page by page so only one page is held in memory at a time
+    paginator = client.get_paginator(operation)
+    for page in paginator.paginate(**kwargs):
+        yield from page.get(result_key, [])
 
-    # 1. AMIs
-    images = ec2.describe_images(Owners=['self'])['Images']
-    for image in images:
-        already_tagged = any(tag['Key'] == 'Tenant' for tag in image.get('Tags', []))
-        name = image.get('Name', '')
-        desc = image.get('Description', '')
-        match = re.search(r'i-[0-9a-f]+', name) or re.search(r'i-[0-9a-f]+', desc)
-        instance_id = match.group(0) if match else None
-        tenant = None
-
-        if instance_id:
-            try:
-                reservations = ec2.describe_instances(InstanceIds=[instance_id])['Reservations']
-                if reservations and reservations[0]['Instances']:
-                    tags = reservations[0]['Instances'][0].get('Tags', [])
-                    tenant = get_tag(tags, 'Tenant')
-            except Exception as e:
-                add_output(output, "AMI", image['ImageId'], tenant or "TagNotExists", f"InstanceDescribeError: {str(e)}", SourceID=instance_id)
-                continue
+def ordered_map(executor, fn, items, window):
+    # Like executor.map, but keeps at most `window` calls in flight and yields in input order
+    if executor is None:
+        yield from map(fn, items)
+        return
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= window:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
 
-        if already_tagged:
-            add_output(output, "AMI", image['ImageId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
-            continue
+def id_filter(name, ids):
+    # Filters, unlike *Ids parameters, return nothing instead of failing on unknown IDs
+    return {} if ids is None else {'Filters': [{'Name': name, 'Values': list(ids)}]}
 
-        if not instance_id:
-            add_output(output, "AMI", image['ImageId'], "TagNotExists", "NoInstanceIdInName")
-            continue
+def index_instances(instances):
+    return {
+        instance['InstanceId']: {
+            'Tags': instance.get('Tags', []),
+            'ImageId': instance.get('ImageId')
+        }
+        for instance in instances
+    }
 
-        if tenant:
-            try:
-                ec2.create_tags(Resources=[image['ImageId']], Tags=[{'Key': 'Tenant', 'Value': tenant}])
-                add_output(output, "AMI", image['ImageId'], tenant, "TagAdded", SourceID=instance_id)
-            except Exception as e:
-                add_output(output, "AMI", image['ImageId'], tenant, f"TagError: {str(e)}", SourceID=instance_id)
-        else:
-            add_output(output, "AMI", image['ImageId'], "TagNotExists", "NoTenantTagOnInstance", SourceID=instance_id)
-
-    # 2. Volumes EBS
-    volumes = ec2.describe_volumes()['Volumes']
-    for vol in volumes:
-        already_tagged = any(tag['Key'] == 'Tenant' for tag in vol.get('Tags', []))
-        attachments = vol.get('Attachments', [])
-        instance_id = attachments[0]['InstanceId'] if attachments and attachments[0].get('InstanceId') else None
-        tenant = None
-
-        # Try to get Tenant tag from AMI if attached to an instance with an AMI
-        if instance_id:
-            # Try to get AMI from instance
-            try:
-                reservations = ec2.describe_instances(InstanceIds=[instance_id])['Reservations']
-                if reservations and reservations[0]['Instances']:
-                    instance = reservations[0]['Instances'][0]
-                    ami_id = instance.get('ImageId')
-                    if ami_id:
-                        # Get the Tenant tag from the AMI if it exists
-                        images = ec2.describe_images(ImageIds=[ami_id])['Images']
-                        if images:
-                            tenant = get_tag(images[0].get('Tags', []), 'Tenant')
-                    # Fallback: get Tenant tag from instance itself if AMI doesn't have it
-                    if not tenant:
-                        tenant = get_tag(instance.get('Tags', []), 'Tenant')
-            except Exception as e:
-                add_output(output, "Volume", vol['VolumeId'], tenant or "TagNotExists", f"InstanceDescribeError: {str(e)}", SourceID=instance_id)
-                continue
+def index_images(images):
+    return {image['ImageId']: image.get('Tags', []) for image in images}
 
-        if already_tagged:
-            add_output(output, "Volume", vol['VolumeId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
-            continue
+def build_instance_index(ec2, instance_ids=None):
+    # One paginated pass instead of a describe_instances call per resource
+    if instance_ids is not None and not instance_ids:
+        return {}
+    reservations = iter_pages(ec2, 'describe_instances', 'Reservations', **id_filter('instance-id', instance_ids))
+    return index_instances(instance for reservation in reservations for instance in reservation['Instances'])
 
-        if not instance_id:
-            add_output(output, "Volume", vol['VolumeId'], "TagNotExists", "NoInstanceAttachment")
-            continue
+def build_image_index(ec2, image_ids=None):
+    # AMI tags are only visible to the owner account, so self-owned AMIs are enough
+    if image_ids is not None and not image_ids:
+        return {}
+    return index_images(iter_pages(ec2, 'describe_images', 'Images', Owners=['self'], **id_filter('image-id', image_ids)))
 
-        if tenant:
-            try:
-                ec2.create_tags(Resources=[vol['VolumeId']], Tags=[{'Key': 'Tenant', 'Value': tenant}])
-                add_output(output, "Volume", vol['VolumeId'], tenant, "TagAdded", SourceID=instance_id)
-            except Exception as e:
-                add_output(output, "Volume", vol['VolumeId'], tenant, f"TagError: {str(e)}", SourceID=instance_id)
-        else:
-            add_output(output, "Volume", vol['VolumeId'], "TagNotExists", "NoTenantTagOnInstanceOrAMI", SourceID=instance_id)
-
-    # 3. Snapshots EBS
-    snapshots = ec2.describe_snapshots(OwnerIds=['self'])['Snapshots']
-    for snap in snapshots:
-        already_tagged = any(tag['Key'] == 'Tenant' for tag in snap.get('Tags', []))
-        volume_id = snap.get('VolumeId')
-        tenant = None
-
-        if volume_id:
-            try:
-                volumes = ec2.describe_volumes(VolumeIds=[volume_id])['Volumes']
-                if volumes:
-                    tenant = get_tag(volumes[0].get('Tags', []), 'Tenant')
-            except Exception as e:
-                if 'InvalidVolume.NotFound' in str(e):
-                    add_output(output, "Snapshot", snap['SnapshotId'], tenant or "TagNotExists", "NoVolumeIDFound", SourceID=volume_id)
-                else:
-                    add_output(output, "Snapshot", snap['SnapshotId'], tenant or "TagNotExists", f"VolumeDescribeError: {str(e)}", SourceID=volume_id)
-                continue
-
-        if already_tagged:
-            add_output(output, "Snapshot", snap['SnapshotId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=volume_id)
-            continue
+def resolve_instance_tenant(instance, image_index):
+    # Tenant tag from the instance's AMI if it exists, falling back to the instance itself
+    tenant = None
+    if instance['ImageId']:
+        tenant = get_tag(image_index.get(instance['ImageId'], []), 'Tenant')
+    return tenant or get_tag(instance['Tags'], 'Tenant')
+
+def resolve_volume_tenant(vol, instance_index, image_index):
+    # Tenant a volume has or will get from the volume section
+    tenant = get_tag(vol.get('Tags', []), 'Tenant')
+    attachments = vol.get('Attachments', [])
+    instance = instance_index.get(attachments[0].get('InstanceId')) if attachments else None
+    if not tenant and instance:
+        tenant = resolve_instance_tenant(instance, image_index)
+    return tenant
+
+class LocalCheckpointStore:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, state):
+        with open(self.path, 'w') as f:
+            json.dump(state, f)
+
+class S3CheckpointStore:
+    def __init__(self, bucket, key):
+        self.s3 = boto3.client('s3')
+        self.bucket = bucket
+        self.key = key
+
+    def load(self):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.key)['Body'].read()
+        except self.s3.exceptions.NoSuchKey:
+            return {}
+        return json.loads(body)
+
+    def save(self, state):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(state).encode('utf-8'), ContentType='application/json')
+
+def get_checkpoint_store(config):
+    if config.get('s3_bucket'):
+        return S3CheckpointStore(config['s3_bucket'], config.get('s3_key', 'resource-addtag/checkpoint.json'))
+    if config.get('path'):
+        return LocalCheckpointStore(config['path'])
+    raise ValueError("Incremental mode requires checkpoint.s3_bucket or checkpoint.path")
+
+class RegionCheckpoint:
+    """
+    Per-region incremental state: IDs known to carry the Tenant tag, and the
+    newest creation time seen for each resource type. A resource is skipped only
+    when its ID is known to be tagged; listings are paged by ID, so a resource
+    created during a scan can be older than the watermark and still unseen.
+    """
+
+    def __init__(self, state, full_rescan=False):
+        self.tagged = {resource_type: set(ids) for resource_type, ids in state.get('tagged', {}).items()}
+        self.full_rescan = full_rescan
+        self.next_tagged = {}
+        # Kept for reporting only, see above
+        self.next_watermarks = dict(state.get('watermarks', {}))
+        self.lock = threading.Lock()  # sections may call in from several threads
+
+    def is_known(self, resource_type, resource_id, created=None):
+        if hasattr(created, 'isoformat'):
+            created = created.isoformat()
+        with self.lock:
+            if created and created > self.next_watermarks.get(resource_type, ''):
+                self.next_watermarks[resource_type] = created
+            if self.full_rescan:
+                return False
+            tagged = resource_id in self.tagged.get(resource_type, ())
+            if tagged:
+                # Carry forward only IDs still listed, so deleted resources drop out
+                self.next_tagged.setdefault(resource_type, set()).add(resource_id)
+            return tagged
+
+    def record(self, output):
+        with self.lock:
+            for entry in output:
+                if entry['Status'] in ("AlreadyTagged", "TagAdded"):
+                    self.next_tagged.setdefault(entry['ResourceType'], set()).add(entry['ResourceId'])
+
+    def to_dict(self):
+        return {
+            'tagged': {resource_type: sorted(ids) for resource_type, ids in self.next_tagged.items()},
+            'watermarks': self.next_watermarks
+        }
+
+def queue_tag(ec2, pending_tags, entry):
+    # Entries are already in the report; write_tag_batch sets their final Status
+    entries = pending_tags.setdefault(entry['Tenant'], [])
+    entries.append(entry)
+    if len(entries) >= CREATE_TAGS_BATCH:
+        write_tag_batch(ec2, entry['Tenant'], pending_tags.pop(entry['Tenant']))
+
+def is_bad_id_error(error):
+    # Errors caused by one of the IDs, as opposed to permissions or throttling that fail every ID alike
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+    return code == 'InvalidID' or code.endswith('.NotFound') or code.endswith('.Malformed')
+
+def write_tag_batch(ec2, tenant, entries):
+    try:
+        ec2.create_tags(Resources=[entry['ResourceId'] for entry in entries], Tags=[{'Key': 'Tenant', 'Value': tenant}])
+        for entry in entries:
+            entry['Status'] = "TagAdded"
+    except Exception as e:
+        if len(entries) == 1 or not is_bad_id_error(e):
+            for entry in entries:
+                entry['Status'] = f"TagError: {str(e)}"
+            return
+        # CreateTags rejects the whole request for a single bad ID, so split to isolate it
+        middle = len(entries) // 2
+        write_tag_batch(ec2, tenant, entries[:middle])
+        write_tag_batch(ec2, tenant, entries[middle:])
 
-        if not volume_id:
-            add_output(output, "Snapshot", snap['SnapshotId'], "TagNotExists", "NoVolumeId")
+def write_entries(ec2, entries):
+    pending_tags = {}
+    for entry in entries:
+        if entry['Status'] == "TagPending":
+            queue_tag(ec2, pending_tags, entry)
+    flush_tags(ec2, pending_tags)
+    return entries
+
+def flush_tags(ec2, pending_tags):
+    for tenant, entries in pending_tags.items():
+        for start in range(0, len(entries), CREATE_TAGS_BATCH):
+            write_tag_batch(ec2, tenant, entries[start:start + CREATE_TAGS_BATCH])
+    pending_tags.clear()
+
+# 1. AMIs
+def image_source_instance(image):
+    match = re.search(r'i-[0-9a-f]+', image.get('Name', '')) or re.search(r'i-[0-9a-f]+', image.get('Description', ''))
+    return match.group(0) if match else None
+
+def plan_image(image, instance_index):
+    already_tagged = any(tag['Key'] == 'Tenant' for tag in image.get('Tags', []))
+    instance_id = image_source_instance(image)
+    tenant = None
+
+    if instance_id:
+        instance = instance_index.get(instance_id)
+        if instance is None:
+            return make_entry("AMI", image['ImageId'], "TagNotExists", "InstanceDescribeError: InvalidInstanceID.NotFound", SourceID=instance_id)
+        tenant = get_tag(instance['Tags'], 'Tenant')
+
+    if already_tagged:
+        return make_entry("AMI", image['ImageId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
+
+    if not instance_id:
+        return make_entry("AMI", image['ImageId'], "TagNotExists", "NoInstanceIdInName")
+
+    if tenant:
+        return make_entry("AMI", image['ImageId'], tenant, "TagPending", SourceID=instance_id)
+    return make_entry("AMI", image['ImageId'], "TagNotExists", "NoTenantTagOnInstance", SourceID=instance_id)
+
+def scan_images(ec2, instance_index, checkpoint=None):
+    for image in iter_pages(ec2, 'describe_images', 'Images', Owners=['self']):
+        if checkpoint and checkpoint.is_known("AMI", image['ImageId'], image.get('CreationDate')):
             continue
+        yield plan_image(image, instance_index)
 
-        if tenant:
-            try:
-                ec2.create_tags(Resources=[snap['SnapshotId']], Tags=[{'Key': 'Tenant', 'Value': tenant}])
-                add_output(output, "Snapshot", snap['SnapshotId'], tenant, "TagAdded", SourceID=volume_id)
-            except Exception as e:
-                add_output(output, "Snapshot", snap['SnapshotId'], tenant, f"TagError: {str(e)}", SourceID=volume_id)
-        else:
-            add_output(output, "Snapshot", snap['SnapshotId'], "TagNotExists", "NoTenantTagOnVolume", SourceID=volume_id)
-
-    # 4. Network Interfaces (ENIs)
-    enis = ec2.describe_network_interfaces()['NetworkInterfaces']
-    for eni in enis:
-        already_tagged = any(tag['Key'] == 'Tenant' for tag in eni.get('TagSet', []))
-        attachment = eni.get('Attachment', {})
-        instance_id = attachment.get('InstanceId')
-        tenant = None
-
-        if instance_id:
-            try:
-                reservations = ec2.describe_instances(InstanceIds=[instance_id])['Reservations']
-                if reservations and reservations[0]['Instances']:
-                    tags = reservations[0]['Instances'][0].get('Tags', [])
-                    tenant = get_tag(tags, 'Tenant')
-            except Exception as e:
-                add_output(output, "NetworkInterface", eni['NetworkInterfaceId'], tenant or "TagNotExists", f"InstanceDescribeError: {str(e)}", SourceID=instance_id)
-                continue
+# 2. Volumes EBS
+def volume_instance(vol):
+    attachments = vol.get('Attachments', [])
+    return attachments[0]['InstanceId'] if attachments and attachments[0].get('InstanceId') else None
+
+def plan_volume(vol, instance_index, image_index):
+    already_tagged = any(tag['Key'] == 'Tenant' for tag in vol.get('Tags', []))
+    instance_id = volume_instance(vol)
+    tenant = None
+
+    # Try to get Tenant tag from AMI if attached to an instance with an AMI
+    if instance_id:
+        instance = instance_index.get(instance_id)
+        if instance is None:
+            return make_entry("Volume", vol['VolumeId'], "TagNotExists", "InstanceDescribeError: InvalidInstanceID.NotFound", SourceID=instance_id)
+        tenant = resolve_instance_tenant(instance, image_index)
 
-        if already_tagged:
-            add_output(output, "NetworkInterface", eni['NetworkInterfaceId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
+    if already_tagged:
+        return make_entry("Volume", vol['VolumeId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
+
+    if not instance_id:
+        return make_entry("Volume", vol['VolumeId'], "TagNotExists", "NoInstanceAttachment")
+
+    if tenant:
+        return make_entry("Volume", vol['VolumeId'], tenant, "TagPending", SourceID=instance_id)
+    return make_entry("Volume", vol['VolumeId'], "TagNotExists", "NoTenantTagOnInstanceOrAMI", SourceID=instance_id)
+
+def scan_volumes(ec2, instance_index, image_index, checkpoint=None):
+    for vol in iter_pages(ec2, 'describe_volumes', 'Volumes'):
+        if checkpoint and checkpoint.is_known("Volume", vol['VolumeId'], vol.get('CreateTime')):
             continue
+        yield plan_volume(vol, instance_index, image_index)
+
+# 3. Snapshots EBS
+def plan_snapshot(snap, volume_index, instance_index, image_index):
+    already_tagged = any(tag['Key'] == 'Tenant' for tag in snap.get('Tags', []))
+    volume_id = snap.get('VolumeId')
+    tenant = None
 
-        if not instance_id:
-            add_output(output, "NetworkInterface", eni['NetworkInterfaceId'], "TagNotExists", "NoInstanceAttachment")
+    if volume_id:
+        vol = volume_index.get(volume_id)
+        if vol is None:
+            return make_entry("Snapshot", snap['SnapshotId'], "TagNotExists", "NoVolumeIDFound", SourceID=volume_id)
+        # Resolve rather than read the tag, the volume section may not have written it yet
+        tenant = resolve_volume_tenant(vol, instance_index, image_index)
+
+    if already_tagged:
+        return make_entry("Snapshot", snap['SnapshotId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=volume_id)
+
+    if not volume_id:
+        return make_entry("Snapshot", snap['SnapshotId'], "TagNotExists", "NoVolumeId")
+
+    if tenant:
+        return make_entry("Snapshot", snap['SnapshotId'], tenant, "TagPending", SourceID=volume_id)
+    return make_entry("Snapshot", snap['SnapshotId'], "TagNotExists", "NoTenantTagOnVolume", SourceID=volume_id)
+
+def lookup_volumes(ec2, volume_cache, lookup_errors, volume_ids):
+    # Describe each volume at most once per run; missing volumes are cached as None
+    missing = [volume_id for volume_id in dict.fromkeys(volume_ids) if volume_id not in volume_cache and volume_id not in lookup_errors]
+    for start in range(0, len(missing), VOLUME_LOOKUP_BATCH):
+        batch = missing[start:start + VOLUME_LOOKUP_BATCH]
+        try:
+            for vol in iter_pages(ec2, 'describe_volumes', 'Volumes', **id_filter('volume-id', batch)):
+                volume_cache[vol['VolumeId']] = vol
+        except Exception as e:
+            for volume_id in batch:
+                lookup_errors[volume_id] = str(e)
             continue
+        for volume_id in batch:
+            volume_cache.setdefault(volume_id, None)
 
-        if tenant:
-            try:
-                ec2.create_tags(Resources=[eni['NetworkInterfaceId']], Tags=[{'Key': 'Tenant', 'Value': tenant}])
-                add_output(output, "NetworkInterface", eni['NetworkInterfaceId'], tenant, "TagAdded", SourceID=instance_id)
-            except Exception as e:
-                add_output(output, "NetworkInterface", eni['NetworkInterfaceId'], tenant, f"TagError: {str(e)}", SourceID=instance_id)
-        else:
-            add_output(output, "NetworkInterface", eni['NetworkInterfaceId'], "TagNotExists", "NoTenantTagOnInstance", SourceID=instance_id)
-
-    # 5. Elastic IPs (EIPs)
-    addresses = ec2.describe_addresses()['Addresses']
-    for addr in addresses:
-        allocation_id = addr.get('AllocationId')
-        instance_id = addr.get('InstanceId')
-        tags = addr.get('Tags', [])
-        already_tagged = any(tag['Key'] == 'Tenant' for tag in tags)
-        tenant = None
-
-        if instance_id:
-            try:
-                reservations = ec2.describe_instances(InstanceIds=[instance_id])['Reservations']
-                if reservations and reservations[0]['Instances']:
-                    instance_tags = reservations[0]['Instances'][0].get('Tags', [])
-                    tenant = get_tag(instance_tags, 'Tenant')
-            except Exception as e:
-                add_output(output, "EIP", allocation_id, tenant or "TagNotExists", f"InstanceDescribeError: {str(e)}", SourceID=instance_id)
-                continue
+def scan_snapshots(ec2, instance_index, image_index, checkpoint=None):
+    snapshots = (
+        snap for snap in iter_pages(ec2, 'describe_snapshots', 'Snapshots', OwnerIds=['self'])
+        if not (checkpoint and checkpoint.is_known("Snapshot", snap['SnapshotId'], snap.get('StartTime')))
+    )
+    # Many snapshots share a volume, so look volumes up per chunk of snapshots instead of per snapshot
+    volume_cache = {}
+    lookup_errors = {}
+    while True:
+        chunk = list(islice(snapshots, SNAPSHOT_CHUNK))
+        if not chunk:
+            break
+        lookup_volumes(ec2, volume_cache, lookup_errors, [snap['VolumeId'] for snap in chunk if snap.get('VolumeId')])
+        for snap in chunk:
+            error = lookup_errors.get(snap.get('VolumeId'))
+            if error:
+                yield make_entry("Snapshot", snap['SnapshotId'], "TagNotExists", f"VolumeDescribeError: {error}", SourceID=snap['VolumeId'])
+            else:
+                yield plan_snapshot(snap, volume_cache, instance_index, image_index)
+
+# 4. Network Interfaces (ENIs)
+def plan_network_interface(eni, instance_index):
+    already_tagged = any(tag['Key'] == 'Tenant' for tag in eni.get('TagSet', []))
+    attachment = eni.get('Attachment', {})
+    instance_id = attachment.get('InstanceId')
+    tenant = None
 
-        if already_tagged:
-            add_output(output, "EIP", allocation_id, tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
+    if instance_id:
+        instance = instance_index.get(instance_id)
+        if instance is None:
+            return make_entry("NetworkInterface", eni['NetworkInterfaceId'], "TagNotExists", "InstanceDescribeError: InvalidInstanceID.NotFound", SourceID=instance_id)
+        tenant = get_tag(instance['Tags'], 'Tenant')
+
+    if already_tagged:
+        return make_entry("NetworkInterface", eni['NetworkInterfaceId'], tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
+
+    if not instance_id:
+        return make_entry("NetworkInterface", eni['NetworkInterfaceId'], "TagNotExists", "NoInstanceAttachment")
+
+    if tenant:
+        return make_entry("NetworkInterface", eni['NetworkInterfaceId'], tenant, "TagPending", SourceID=instance_id)
+    return make_entry("NetworkInterface", eni['NetworkInterfaceId'], "TagNotExists", "NoTenantTagOnInstance", SourceID=instance_id)
+
+def scan_network_interfaces(ec2, instance_index, checkpoint=None):
+    for eni in iter_pages(ec2, 'describe_network_interfaces', 'NetworkInterfaces'):
+        if checkpoint and checkpoint.is_known("NetworkInterface", eni['NetworkInterfaceId']):
             continue
+        yield plan_network_interface(eni, instance_index)
+
+# 5. Elastic IPs (EIPs)
+def plan_address(addr, instance_index):
+    allocation_id = addr.get('AllocationId')
+    instance_id = addr.get('InstanceId')
+    tags = addr.get('Tags', [])
+    already_tagged = any(tag['Key'] == 'Tenant' for tag in tags)
+    tenant = None
+
+    if instance_id:
+        instance = instance_index.get(instance_id)
+        if instance is None:
+            return make_entry("EIP", allocation_id, "TagNotExists", "InstanceDescribeError: InvalidInstanceID.NotFound", SourceID=instance_id)
+        tenant = get_tag(instance['Tags'], 'Tenant')
+
+    if already_tagged:
+        return make_entry("EIP", allocation_id, tenant or "TagNotExists", "AlreadyTagged", SourceID=instance_id)
+
+    if not instance_id:
+        return make_entry("EIP", allocation_id, "TagNotExists", "NoInstanceAttachment")
 
-        if not instance_id:
-            add_output(output, "EIP", allocation_id, "TagNotExists", "NoInstanceAttachment")
+    if tenant:
+        return make_entry("EIP", allocation_id, tenant, "TagPending", SourceID=instance_id)
+    return make_entry("EIP", allocation_id, "TagNotExists", "NoTenantTagOnInstance", SourceID=instance_id)
+
+def scan_addresses(ec2, instance_index, checkpoint=None):
+    # DescribeAddresses is not paginated and always returns every address
+    for addr in ec2.describe_addresses()['Addresses']:
+        if checkpoint and checkpoint.is_known("EIP", addr.get('AllocationId')):
             continue
+        yield plan_address(addr, instance_index)
 
-        if tenant:
-            try:
-                ec2.create_tags(Resources=[allocation_id], Tags=[{'Key': 'Tenant', 'Value': tenant}])
-                add_output(output, "EIP", allocation_id, tenant, "TagAdded", SourceID=instance_id)
-            except Exception as e:
-                add_output(output, "EIP", allocation_id, tenant, f"TagError: {str(e)}", SourceID=instance_id)
-        else:
-            add_output(output, "EIP", allocation_id, "TagNotExists", "NoTenantTagOnInstance", SourceID=instance_id)
+# 6. KMS: Tag customer-managed keys with alias name as Tenant (us-east-1)
+def alias_tenant(alias_name):
+    # FIX: Remove 'alias/' prefix for the tag value
+    return alias_name[len('alias/'):] if alias_name.startswith('alias/') else alias_name
+
+def is_customer_alias(alias):
+    return alias.get('TargetKeyId') and not alias.get('AliasName', '').startswith('alias/aws/')
+
+def group_aliases(aliases):
+    # One group per key, sorted so the lowest alias name always sets the Tenant
+    keys = {}
+    for alias in aliases:
+        if is_customer_alias(alias):
+            keys.setdefault(alias['TargetKeyId'], []).append(alias)
+    return [sorted(group, key=lambda alias: alias['AliasName']) for group in keys.values()]
+
+def plan_kms_key(aliases, key_tags):
+    key_id = aliases[0]['TargetKeyId']
+    tenant_value = alias_tenant(aliases[0]['AliasName'])
+    extra = {'Aliases': [alias['AliasName'] for alias in aliases]} if len(aliases) > 1 else {}
+    existing_tenant = next((t['TagValue'] for t in key_tags if t['TagKey'] == 'Tenant'), None)
+    if existing_tenant == tenant_value:
+        return make_entry("KMS", key_id, tenant_value, "AlreadyTagged", **extra)
+    return make_entry("KMS", key_id, tenant_value, "TagPending", **extra)
+
+def reconcile_kms_key(kms, aliases, dry_run=False):
+    key_id = aliases[0]['TargetKeyId']
+    try:
+        entry = plan_kms_key(aliases, kms.list_resource_tags(KeyId=key_id).get('Tags', []))
+        if entry['Status'] == "TagPending" and not dry_run:
+            kms.tag_resource(
+                KeyId=key_id,
+                Tags=[{'TagKey': 'Tenant', 'TagValue': entry['Tenant']}]
+            )
+            entry['Status'] = "TagAdded"
+        return entry
+    except Exception as e:
+        return make_entry("KMS", key_id, alias_tenant(aliases[0]['AliasName']), f"TagError: {str(e)}")
+
+def scan_kms_keys(kms, executor=None, window=1, checkpoint=None, dry_run=False):
+    # Aliases are few, so group them all first and then read/write each key once
+    keys = []
+    for aliases in group_aliases(iter_pages(kms, 'list_aliases', 'Aliases')):
+        newest_alias = max((alias['CreationDate'] for alias in aliases if alias.get('CreationDate')), default=None)
+        if not (checkpoint and checkpoint.is_known("KMS", aliases[0]['TargetKeyId'], newest_alias)):
+            keys.append(aliases)
+    yield from ordered_map(executor, lambda aliases: reconcile_kms_key(kms, aliases, dry_run), keys, window)
+
+ROUTE53_TAG_BATCH = 10  # ListTagsForResources accepts up to 10 hosted zones per request
+ROUTE53_REQUESTS_PER_SECOND = 5  # Route 53 API limit per account
 
-    # 6. KMS: Tag customer-managed keys with alias name as Tenant (us-east-1)
-    paginator = kms.get_paginator('list_aliases')
+class RateLimiter:
+    # Spaces calls evenly so concurrent workers stay under a requests-per-second limit
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+ROUTE53_LIMITER = RateLimiter(ROUTE53_REQUESTS_PER_SECOND)
+
+def load_hosted_zone_tags(route53, zone_filter=None):
+    """
+    Paginates every hosted zone and reads their tags 10 zones per
+    ListTagsForResources call, running the batches concurrently within the
+    Route 53 rate limit. Returns the zones and a zone id -> tags mapping.
+    """
+    zones = []
+    paginator = route53.get_paginator('list_hosted_zones')
     for page in paginator.paginate():
-        for alias in page['Aliases']:
-            alias_name = alias.get('AliasName', '')
-            key_id = alias.get('TargetKeyId')
-            if alias_name.startswith('alias/aws/') or not key_id:
-                continue
-            # FIX: Remove 'alias/' prefix for the tag value
-            tenant_value = alias_name[len('alias/'):] if alias_name.startswith('alias/') else alias_name
-            try:
-                tags_resp = kms.list_resource_tags(KeyId=key_id)
-                existing_tenant = next((t['TagValue'] for t in tags_resp.get('Tags', []) if t['TagKey'] == 'Tenant'), None)
-                if existing_tenant == tenant_value:
-                    add_output(output, "KMS", key_id, tenant_value, "AlreadyTagged")
-                    continue
-                kms.tag_resource(
-                    KeyId=key_id,
-                    Tags=[{'TagKey': 'Tenant', 'TagValue': tenant_value}]
-                )
-                add_output(output, "KMS", key_id, tenant_value, "TagAdded")
-            except Exception as e:
-                add_output(output, "KMS", key_id, tenant_value, f"TagError: {str(e)}")
-
-    # 7. Route 53: Tag hosted zones with description as Tenant (only if needed)
-    hosted_zones = route53.list_hosted_zones()['HostedZones']
-    for zone in hosted_zones:
-        zone_id = zone['Id'].split('/')[-1]
-        description = zone.get('Config', {}).get('Comment', '')
-        tenant_value = description
-        if description:
+        zones.extend(zone for zone in page['HostedZones'] if not zone_filter or zone_filter(zone))
+        ROUTE53_LIMITER.wait()
+    zone_ids = [zone['Id'].split('/')[-1] for zone in zones]
+    batches = [zone_ids[start:start + ROUTE53_TAG_BATCH] for start in range(0, len(zone_ids), ROUTE53_TAG_BATCH)]
+
+    def fetch_tags(batch):
+        ROUTE53_LIMITER.wait()
+        return route53.list_tags_for_resources(ResourceType='hostedzone', ResourceIds=batch)['ResourceTagSets']
+
+    zone_tags = {}
+    with ThreadPoolExecutor(max_workers=ROUTE53_REQUESTS_PER_SECOND) as pool:
+        for tag_sets in pool.map(fetch_tags, batches):
+            for tag_set in tag_sets:
+                zone_tags[tag_set['ResourceId']] = tag_set.get('Tags', [])
+    return zones, zone_tags
+
+# 7. Route 53: Tag hosted zones with description as Tenant (only if needed)
+def plan_hosted_zone(zone, zone_tags):
+    zone_id = zone['Id'].split('/')[-1]
+    tenant_value = zone.get('Config', {}).get('Comment', '')
+    if not tenant_value:
+        return make_entry("Route53HostedZone", zone_id, "", "NoDescriptionNoTag")
+    existing_tenant = next((t['Value'] for t in zone_tags if t['Key'] == 'Tenant'), None)
+    if existing_tenant == tenant_value:
+        return make_entry("Route53HostedZone", zone_id, tenant_value, "AlreadyTagged")
+    return make_entry("Route53HostedZone", zone_id, tenant_value, "TagPending")
+
+def reconcile_hosted_zone(route53, zone, zone_tags, dry_run=False):
+    entry = plan_hosted_zone(zone, zone_tags)
+    if entry['Status'] == "TagPending" and not dry_run:
+        try:
+            ROUTE53_LIMITER.wait()
+            route53.change_tags_for_resource(
+                ResourceType='hostedzone',
+                ResourceId=entry['ResourceId'],
+                AddTags=[{'Key': 'Tenant', 'Value': entry['Tenant']}]
+            )
+            entry['Status'] = "TagAdded"
+        except Exception as e:
+            entry['Status'] = f"TagError: {str(e)}"
+    return entry
+
+def scan_hosted_zones(route53, executor=None, window=1, checkpoint=None, dry_run=False):
+    zones, zone_tags = load_hosted_zone_tags(
+        route53,
+        lambda zone: not (checkpoint and checkpoint.is_known("Route53HostedZone", zone['Id'].split('/')[-1]))
+    )
+    yield from ordered_map(executor, lambda zone: reconcile_hosted_zone(route53, zone, zone_tags.get(zone['Id'].split('/')[-1], []), dry_run), zones, window)
+
+def plan_inventory(inventory):
+    """
+    Pure planning pass over an inventory snapshot, with no AWS calls. The
+    inventory holds the describe/list API items as plain dicts (or parsed JSON):
+
+    {
+      "Instances": [...], "Images": [...], "Volumes": [...], "Snapshots": [...],
+      "NetworkInterfaces": [...], "Addresses": [...], "Aliases": [...],
+      "KeyTags": {"KEY_ID": [...]}, "HostedZones": [...], "ZoneTags": {"ZONE_ID": [...]}
+    }
+
+    Yields report entries in section order; resources that need a tag are
+    left as TagPending.
+    """
+    instance_index = index_instances(inventory.get('Instances', []))
+    image_index = index_images(inventory.get('Images', []))
+    volume_index = {vol['VolumeId']: vol for vol in inventory.get('Volumes', [])}
+    key_tags = inventory.get('KeyTags', {})
+    zone_tags = inventory.get('ZoneTags', {})
+
+    for image in inventory.get('Images', []):
+        yield plan_image(image, instance_index)
+    for vol in inventory.get('Volumes', []):
+        yield plan_volume(vol, instance_index, image_index)
+    for snap in inventory.get('Snapshots', []):
+        yield plan_snapshot(snap, volume_index, instance_index, image_index)
+    for eni in inventory.get('NetworkInterfaces', []):
+        yield plan_network_interface(eni, instance_index)
+    for addr in inventory.get('Addresses', []):
+        yield plan_address(addr, instance_index)
+    for aliases in group_aliases(inventory.get('Aliases', [])):
+        yield plan_kms_key(aliases, key_tags.get(aliases[0]['TargetKeyId'], []))
+    for zone in inventory.get('HostedZones', []):
+        yield plan_hosted_zone(zone, zone_tags.get(zone['Id'].split('/')[-1], []))
+
+def run_sections(sections, executor):
+    # Sections run in parallel but are joined in list order, so the report order never changes
+    if executor is None:
+        for section in sections:
+            yield from section()
+        return
+    futures = [executor.submit(lambda section=section: list(section())) for section in sections]
+    for future in futures:
+        yield from future.result()
+
+def worker_pool(size):
+    # None keeps the work on the calling thread
+    return ThreadPoolExecutor(max_workers=size) if size > 1 else None
+
+def shutdown_pools(*pools):
+    for pool in pools:
+        if pool:
+            pool.shutdown()
+
+def tag_region(ec2, kms, concurrency, checkpoint=None, dry_run=False):
+    output = []
+    pending_tags = {}
+
+    section_pool = worker_pool(min(concurrency, 6))
+    item_pool = worker_pool(concurrency)
+    try:
+        instance_index, image_index = run_sections([
+            lambda: [build_instance_index(ec2)],
+            lambda: [build_image_index(ec2)]
+        ], section_pool)
+
+        # Each section is a generator: list -> resolve tenant -> plan, then queued here for writing
+        sections = [
+            lambda: scan_images(ec2, instance_index, checkpoint),
+            lambda: scan_volumes(ec2, instance_index, image_index, checkpoint),
+            lambda: scan_snapshots(ec2, instance_index, image_index, checkpoint),
+            lambda: scan_network_interfaces(ec2, instance_index, checkpoint),
+            lambda: scan_addresses(ec2, instance_index, checkpoint),
+            lambda: scan_kms_keys(kms, item_pool, concurrency, checkpoint, dry_run)
+        ]
+        for entry in run_sections(sections, section_pool):
+            output.append(entry)
+            if entry['Status'] == "TagPending" and not dry_run:
+                queue_tag(ec2, pending_tags, entry)
+
+        flush_tags(ec2, pending_tags)
+    finally:
+        shutdown_pools(section_pool, item_pool)
+
+    if checkpoint:
+        checkpoint.record(output)
+    for entry in output:
+        entry['Region'] = kms.meta.region_name if entry['ResourceType'] == "KMS" else ec2.meta.region_name
+    return output
+
+def tag_hosted_zones(route53, concurrency, checkpoint=None, dry_run=False):
+    item_pool = worker_pool(concurrency)
+    try:
+        output = list(scan_hosted_zones(route53, item_pool, concurrency, checkpoint, dry_run))
+    finally:
+        shutdown_pools(item_pool)
+
+    if checkpoint:
+        checkpoint.record(output)
+    # Route 53 is a global service, so it is tagged once regardless of the regions requested
+    for entry in output:
+        entry['Region'] = "global"
+    return output
+
+def lambda_handler(event, context):
+    """
+    Optional event parameters:
+
+    {
+      "concurrency": 8,
+      "regions": ["sa-east-1", "us-east-1"],
+      "incremental": true,
+      "checkpoint": {"s3_bucket": "BUCKET", "s3_key": "resource-addtag/checkpoint.json"},
+      "full_rescan": false,
+      "dry_run": true
+    }
+
+    concurrency > 1 runs the sections, and the per-item KMS and Route 53
+    calls, on bounded thread pools of that size.
+    regions lists the regions to tag, or "all" to use every region enabled
+    for the account. Without it EC2 uses the Lambda's region and KMS us-east-1.
+    incremental skips resources recorded in the checkpoint (S3 object, or
+    {"path": "/tmp/..."} for a local file) and omits them from the report;
+    full_rescan examines everything again and rebuilds the checkpoint.
+    dry_run returns the plan without writing any tag (pending writes stay
+    TagPending) or saving the checkpoint. Passing "inventory" instead plans
+    that snapshot offline, see plan_inventory.
+    """
+    if 'inventory' in event:
+        return list(plan_inventory(event['inventory']))
+
+    dry_run = event.get('dry_run', False)
+    concurrency = int(event.get('concurrency', 1))
+    regions = event.get('regions')
+    if regions == 'all':
+        regions = [region['RegionName'] for region in boto3.client('ec2').describe_regions()['Regions']]
+
+    if regions:
+        clients = [(region, boto3.client('ec2', region_name=region), boto3.client('kms', region_name=region, config=KMS_CONFIG)) for region in regions]
+    else:
+        ec2 = boto3.client('ec2')
+        clients = [(ec2.meta.region_name, ec2, boto3.client('kms', region_name='us-east-1', config=KMS_CONFIG))]
+    route53 = boto3.client('route53')
+
+    store = None
+    checkpoints = {}
+    if event.get('incremental'):
+        store = get_checkpoint_store(event.get('checkpoint', {}))
+        state = store.load()
+        regions_state = state.get('regions', {})
+        for region in [region for region, _, _ in clients] + ["global"]:
+            checkpoints[region] = RegionCheckpoint(regions_state.get(region, {}), event.get('full_rescan', False))
+
+    # One worker per region plus Route 53; results are merged in request order
+    output = []
+    with ThreadPoolExecutor(max_workers=len(clients) + 1) as region_pool:
+        futures = [(region, region_pool.submit(tag_region, ec2, kms, concurrency, checkpoints.get(region), dry_run)) for region, ec2, kms in clients]
+        futures.append(("global", region_pool.submit(tag_hosted_zones, route53, concurrency, checkpoints.get("global"), dry_run)))
+        for region, future in futures:
             try:
-                tags_resp = route53.list_tags_for_resource(ResourceType='hostedzone', ResourceId=zone_id)
-                existing_tenant = next((t['Value'] for t in tags_resp.get('ResourceTagSet', {}).get('Tags', []) if t['Key'] == 'Tenant'), None)
-                if existing_tenant == tenant_value:
-                    add_output(output, "Route53HostedZone", zone_id, tenant_value, "AlreadyTagged")
-                    continue
-                route53.change_tags_for_resource(
-                    ResourceType='hostedzone',
-                    ResourceId=zone_id,
-                    AddTags=[{'Key': 'Tenant', 'Value': tenant_value}]
-                )
-                add_output(output, "Route53HostedZone", zone_id, tenant_value, "TagAdded")
+                output.extend(future.result())
             except Exception as e:
-                add_output(output, "Route53HostedZone", zone_id, tenant_value, f"TagError: {str(e)}")
-        else:
-            add_output(output, "Route53HostedZone", zone_id, "", "NoDescriptionNoTag")
+                output.append(make_entry("Region", region, "", f"RegionError: {str(e)}", Region=region))
+                # Keep the previous state for a region that did not finish
+                checkpoints.pop(region, None)
+
+    if store and not dry_run:
+        state['regions'] = {**regions_state, **{region: checkpoint.to_dict() for region, checkpoint in checkpoints.items()}}
+        store.save(state)
 
     return output
+
+def index_for_instances(ec2, instance_ids):
+    instance_index = build_instance_index(ec2, {instance_id for instance_id in instance_ids if instance_id})
+    image_index = build_image_index(ec2, {instance['ImageId'] for instance in instance_index.values() if instance['ImageId']})
+    return instance_index, image_index
+
+def tag_event_instances(region, request, response):
+    # Tag the volumes and ENIs created alongside the instances
+    ec2 = boto3.client('ec2', region_name=region)
+    instance_ids = [item['instanceId'] for item in response.get('instancesSet', {}).get('items', [])]
+    instance_index, image_index = index_for_instances(ec2, instance_ids)
+    attached = id_filter('attachment.instance-id', instance_ids)
+    entries = [plan_volume(vol, instance_index, image_index) for vol in iter_pages(ec2, 'describe_volumes', 'Volumes', **attached)]
+    entries += [plan_network_interface(eni, instance_index) for eni in iter_pages(ec2, 'describe_network_interfaces', 'NetworkInterfaces', **attached)]
+    return write_entries(ec2, entries)
+
+def tag_event_volume(region, request, response):
+    ec2 = boto3.client('ec2', region_name=region)
+    volume_id = response.get('volumeId') or request.get('volumeId')
+    volumes = ec2.describe_volumes(VolumeIds=[volume_id])['Volumes']
+    instance_index, image_index = index_for_instances(ec2, [volume_instance(vol) for vol in volumes])
+    return write_entries(ec2, [plan_volume(vol, instance_index, image_index) for vol in volumes])
+
+def tag_event_snapshot(region, request, response):
+    ec2 = boto3.client('ec2', region_name=region)
+    snapshots = ec2.describe_snapshots(SnapshotIds=[response['snapshotId']])['Snapshots']
+    volume_ids = {snap['VolumeId'] for snap in snapshots if snap.get('VolumeId')}
+    volumes = list(iter_pages(ec2, 'describe_volumes', 'Volumes', **id_filter('volume-id', volume_ids))) if volume_ids else []
+    instance_index, image_index = index_for_instances(ec2, [volume_instance(vol) for vol in volumes])
+    volume_index = {vol['VolumeId']: vol for vol in volumes}
+    return write_entries(ec2, [plan_snapshot(snap, volume_index, instance_index, image_index) for snap in snapshots])
+
+def tag_event_image(region, request, response):
+    ec2 = boto3.client('ec2', region_name=region)
+    images = ec2.describe_images(ImageIds=[response['imageId']])['Images']
+    instance_index, _ = index_for_instances(ec2, [image_source_instance(image) for image in images])
+    return write_entries(ec2, [plan_image(image, instance_index) for image in images])
+
+def tag_event_address(region, request, response):
+    ec2 = boto3.client('ec2', region_name=region)
+    allocation_id = response.get('allocationId') or request.get('allocationId')
+    addresses = ec2.describe_addresses(AllocationIds=[allocation_id])['Addresses']
+    instance_index, _ = index_for_instances(ec2, [addr.get('InstanceId') for addr in addresses])
+    return write_entries(ec2, [plan_address(addr, instance_index) for addr in addresses])
+
+def tag_event_key(region, request, response):
+    kms = boto3.client('kms', region_name=region, config=KMS_CONFIG)
+    key_id = response.get('keyMetadata', {}).get('keyId') or request.get('targetKeyId')
+    return [reconcile_kms_key(kms, aliases) for aliases in group_aliases(iter_pages(kms, 'list_aliases', 'Aliases', KeyId=key_id))]
+
+def tag_event_hosted_zone(region, request, response):
+    route53 = boto3.client('route53')
+    zone_id = response.get('hostedZone', {}).get('id') or request.get('id')
+    zone = route53.get_hosted_zone(Id=zone_id)['HostedZone']
+    zone_tags = route53.list_tags_for_resource(ResourceType='hostedzone', ResourceId=zone['Id'].split('/')[-1])
+    return [reconcile_hosted_zone(route53, zone, zone_tags.get('ResourceTagSet', {}).get('Tags', []))]
+
+# CloudTrail eventName -> handler for the single resource it names
+EVENT_HANDLERS = {
+    'RunInstances': tag_event_instances,
+    'CreateVolume': tag_event_volume,
+    'AttachVolume': tag_event_volume,
+    'CreateSnapshot': tag_event_snapshot,
+    'CreateImage': tag_event_image,
+    'AllocateAddress': tag_event_address,
+    'AssociateAddress': tag_event_address,
+    'CreateKey': tag_event_key,
+    'CreateAlias': tag_event_key,
+    'CreateHostedZone': tag_event_hosted_zone,
+    'UpdateHostedZoneComment': tag_event_hosted_zone
+}
+
+def event_handler(event, context):
+    """
+    Entry point for EventBridge "AWS API Call via CloudTrail" events. Set the
+    function handler to lambda_function.event_handler and route the events
+    listed in EVENT_HANDLERS to it; only the resource named in the event is
+    resolved and tagged, using the same rules as the full scan.
+    """
+    detail = event.get('detail', {})
+    event_name = detail.get('eventName')
+    region = detail.get('awsRegion') or event.get('region')
+    handler = EVENT_HANDLERS.get(event_name)
+    if not handler:
+        return [make_entry("Event", event_name, "", "UnsupportedEvent", Region=region)]
+    if detail.get('errorCode'):
+        return [make_entry("Event", event_name, "", f"FailedApiCall: {detail['errorCode']}", Region=region)]
+
+    output = handler(region, detail.get('requestParameters') or {}, detail.get('responseElements') or {})
+    for entry in output:
+        entry['Region'] = "global" if entry['ResourceType'] == "Route53HostedZone" else region
+    return output
+
+def synthetic_inventory(count):
+    # Roughly the resource mix of our large accounts
+    tenants = [f"tenant-{n}" for n in range(50)]
+    instances = [
+        {'InstanceId': f"i-{n:017x}", 'ImageId': f"ami-{n % 500:017x}", 'Tags': [{'Key': 'Tenant', 'Value': tenants[n % 50]}] if n % 4 else []}
+        for n in range(max(count // 20, 1))
+    ]
+    images = [
+        {'ImageId': f"ami-{n:017x}", 'Name': f"backup-{instances[n % len(instances)]['InstanceId']}", 'Tags': [{'Key': 'Tenant', 'Value': tenants[n % 50]}] if n % 2 else []}
+        for n in range(max(count // 100, 1))
+    ]
+    volumes = [
+        {'VolumeId': f"vol-{n:017x}", 'Attachments': [{'InstanceId': instances[n % len(instances)]['InstanceId']}] if n % 10 else [], 'Tags': []}
+        for n in range(count * 2 // 5)
+    ]
+    snapshots = [
+        {'SnapshotId': f"snap-{n:017x}", 'VolumeId': volumes[n % len(volumes)]['VolumeId'] if n % 20 else f"vol-deleted{n}", 'Tags': []}
+        for n in range(count * 7 // 20)
+    ]
+    enis = [
+        {'NetworkInterfaceId': f"eni-{n:017x}", 'Attachment': {'InstanceId': instances[n % len(instances)]['InstanceId']}, 'TagSet': []}
+        for n in range(count * 3 // 20)
+    ]
+    addresses = [
+        {'AllocationId': f"eipalloc-{n:017x}", 'InstanceId': instances[n % len(instances)]['InstanceId'] if n % 3 else None, 'Tags': []}
+        for n in range(count // 50)
+    ]
+    aliases = [{'AliasName': f"alias/{tenants[n % 50]}", 'TargetKeyId': f"key-{n}"} for n in range(max(count // 1000, 1))]
+    zones = [{'Id': f"/hostedzone/Z{n:012d}", 'Config': {'Comment': tenants[n % 50]}} for n in range(max(count * 19 // 1000, 1))]
+    return {
+        'Instances': instances, 'Images': images, 'Volumes': volumes, 'Snapshots': snapshots,
+        'NetworkInterfaces': enis, 'Addresses': addresses, 'Aliases': aliases, 'KeyTags': {},
+        'HostedZones': zones, 'ZoneTags': {}
+    }
+
+def run_benchmark(count):
+    import tracemalloc
+
+    inventory = synthetic_inventory(count)
+
+    started = time.perf_counter()
+    statuses = {}
+    for entry in plan_inventory(inventory):
+        statuses[entry['Status']] = statuses.get(entry['Status'], 0) + 1
+    elapsed = time.perf_counter() - started
+    # Only planned entries count; instances are lookup data and aliases collapse into one entry per key
+    resources = sum(statuses.values())
+
+    # Separate pass, tracing slows the planner down too much to time it at the same time
+    tracemalloc.start()
+    for entry in plan_inventory(inventory):
+        pass
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'Resources': resources,
+        'Seconds': round(elapsed, 3),
+        'ResourcesPerSecond': round(resources / elapsed),
+        'PeakPlannerMemoryMB': round(peak / 1024 / 1024, 1),
+        'Statuses': statuses
+    }
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Plan Tenant tags offline, without calling AWS")
+    parser.add_argument('inventory', nargs='?', help="inventory JSON file to plan (see plan_inventory)")
+    parser.add_argument('--benchmark', type=int, metavar='RESOURCES', help="plan a synthetic inventory of this size and report throughput and peak memory")
+    args = parser.parse_args()
+    if args.benchmark:
+        result = run_benchmark(args.benchmark)
+    elif args.inventory:
+        with open(args.inventory) as f:
+            result = list(plan_inventory(json.load(f)))
+    else:
+        parser.error("pass an inventory file or --benchmark")
+    json.dump(result, sys.stdout, indent=2, default=str)
+    print()
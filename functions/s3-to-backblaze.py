@@ -1,11 +1,1601 @@
 import boto3
+import base64
+import csv
+import gzip
+import hashlib
+import io
 import json
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+import zlib
+from urllib.parse import unquote_plus
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime
+from itertools import chain, islice
 import logging
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import crc32c
+except ImportError:
+    crc32c = None
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Bucket regions and per-region clients are kept across warm invocations
+BUCKET_REGIONS = {}
+UNKNOWN_REGION = object()  # cached for buckets whose lookup failed, so it is not retried for every object
+REGION_CLIENTS = {}
+REGION_LOCK = threading.Lock()
+# The metrics and bucket of the copy running on this thread, read by the client call hooks
+CALL_CONTEXT = threading.local()
+
+DEFAULT_PART_SIZE_MB = 16
+MIN_PART_SIZE = 5 * 1024 * 1024  # smallest part B2 accepts, except for the last one
+MAX_PARTS = 10000
+READ_CHUNK = 1024 * 1024
+QUEUE_DEPTH = 4  # listed objects buffered per worker
+STOP = object()
+DEFAULT_DEADLINE_MARGIN_SECONDS = 15  # time left for in-flight copies and the response
+DEFAULT_BUNDLE_SIZE_MB = 16
+TAR_BLOCK = 512
+# Content that is already compressed is not worth compressing again
+SKIP_COMPRESSION = (
+    '.gz', '.tgz', '.zip', '.zst', '.bz2', '.xz', '.7z', '.rar', '.br', '.lz4',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.mp4', '.mov', '.mkv', '.avi', '.webm',
+    '.parquet', '.orc', '.avro',
+    'image/', 'video/', 'audio/', 'application/zip', 'application/gzip', 'application/x-gzip', 'application/zstd'
+)
+DEFAULT_CAS_CACHE = '/tmp/s3-to-backblaze-cas-index.json'  # /tmp survives warm invocations
+CAS_INDEX_KEY = 'cas/index.json.gz'
+MAX_MISMATCHED_KEYS = 100  # keys listed per bucket in the verification summary
+SHARD_KEYS = ('bucket', 'index', 'count', 'start_after', 'end_key')
+PLAN_PAGE_KEYS = 1000
+PLAN_CALLS_PER_SHARD = 8  # listing calls a bucket may spend on planning, per shard asked for
+PLAN_WORKERS = 8  # buckets planned at once
+LAST_KEY_CHAR = '\U0010ffff'  # sorts after any character a key can hold, so prefix + it skips the prefix
+# Settings only the coordinator uses; everything else is passed on to shard workers
+COORDINATOR_KEYS = ('fan_out', 'continuation', 'executor', 'shards_per_bucket', 'max_workers', 'worker_function')
+# Buckets whose GetBucketLocation returns no region or a legacy name
+LEGACY_REGIONS = {None: 'us-east-1', '': 'us-east-1', 'EU': 'eu-west-1'}
+DEFAULT_METRICS_NAMESPACE = 'S3ToBackblaze'
+PUT_OPERATIONS = ('PutObject', 'UploadPart')
+LATENCY_PERCENTILES = (50, 90, 99)
+SCHEDULE_WINDOW = 10000  # listed objects sorted and scheduled at a time
+# Guesses used until copies have been timed, and slack on every estimate
+DEFAULT_OBJECT_SECONDS = 0.1
+DEFAULT_WORKER_MBPS = 10
+ESTIMATE_SAFETY = 1.25
+
+def iter_parts(chunks, part_size):
+    # Re-chunk a byte stream into part_size pieces. Chunks are collected until they make up a part and
+    # joined once, so cutting a part briefly needs two parts of memory and uploading it one
+    pending = []
+    size = 0
+    for chunk in chunks:
+        pending.append(chunk)
+        size += len(chunk)
+        while size >= part_size:
+            last = pending[-1]
+            cut = len(last) - (size - part_size)
+            pending[-1] = memoryview(last)[:cut]
+            part = b''.join(pending)
+            pending = [last[cut:]] if cut < len(last) else []
+            size -= part_size
+            yield part
+            del part
+    if pending:
+        yield b''.join(pending)
+
+def prepended(head, rest):
+    # chain(head, rest) would keep the head items referenced until the whole upload is done
+    while head:
+        yield head.pop(0)
+    yield from rest
+
+def part_size_for(size, part_size):
+    # Grow the part size for objects that would otherwise need more than MAX_PARTS parts
+    return max(part_size, -(-size // MAX_PARTS))
+
+class ChecksumMismatch(Exception):
+    pass
+
+class Checksums:
+    # MD5, and CRC32C when the crc32c module is installed, of bytes as they stream by
+    def __init__(self):
+        self.md5 = hashlib.md5()
+        self.crc = 0 if crc32c else None
+
+    def update(self, chunk):
+        self.md5.update(chunk)
+        if self.crc is not None:
+            self.crc = crc32c.crc32c(chunk, self.crc)
+
+    def metadata(self):
+        metadata = {'source-md5': self.md5.hexdigest()}
+        if self.crc is not None:
+            metadata['source-crc32c'] = f"{self.crc:08x}"
+        return metadata
+
+def source_status(checksums, response):
+    # The S3 ETag is the content MD5 only for single-part uploads without SSE-KMS or SSE-C
+    etag = response.get('ETag', '').strip('"')
+    if not etag or '-' in etag or response.get('ServerSideEncryption', '').startswith('aws:kms') or response.get('SSECustomerAlgorithm'):
+        return 'unverifiable'
+    if checksums.md5.hexdigest() != etag:
+        raise ChecksumMismatch(f"source MD5 {checksums.md5.hexdigest()} does not match ETag {etag}")
+    return 'verified'
+
+def check_etag(response, expected):
+    etag = response.get('ETag', '').strip('"')
+    if etag and etag != expected:
+        raise ChecksumMismatch(f"B2 ETag {etag} does not match the uploaded bytes ({expected})")
+
+def upload_stream(b2_client, dest_bucket, dest_key, parts, metadata, checksums=None):
+    """
+    A single part is sent with put_object; anything larger becomes a multipart
+    upload. With checksums, every request carries its Content-MD5 for B2 to
+    check, the returned ETag is compared with the bytes sent, and a single put
+    also records the (by then complete) source checksums in its metadata.
+    """
+    first = next(parts, b'')
+    second = next(parts, None)
+    if second is None:
+        if not checksums:
+            b2_client.put_object(Bucket=dest_bucket, Key=dest_key, Body=first, Metadata=metadata)
+            return
+        digest = hashlib.md5(first)
+        response = b2_client.put_object(
+            Bucket=dest_bucket,
+            Key=dest_key,
+            Body=first,
+            Metadata=dict(metadata, **checksums.metadata()),
+            ContentMD5=base64.b64encode(digest.digest()).decode('ascii')
+        )
+        check_etag(response, digest.hexdigest())
+        return
+    # Each part is dropped once sent: a worker holds one part while uploading and briefly two while
+    # cutting the next, three at most while the look-ahead cuts the second part
+    parts = prepended([first, second], parts)
+    del first, second
+    upload_id = b2_client.create_multipart_upload(Bucket=dest_bucket, Key=dest_key, Metadata=metadata)['UploadId']
+    try:
+        completed = []
+        part_digests = []
+        number = 0
+        for part in parts:
+            number += 1
+            kwargs = {}
+            if checksums:
+                digest = hashlib.md5(part)
+                part_digests.append(digest.digest())
+                kwargs['ContentMD5'] = base64.b64encode(digest.digest()).decode('ascii')
+            response = b2_client.upload_part(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id, PartNumber=number, Body=part, **kwargs)
+            completed.append({'PartNumber': number, 'ETag': response['ETag']})
+            del part
+        response = b2_client.complete_multipart_upload(
+            Bucket=dest_bucket,
+            Key=dest_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed}
+        )
+    except Exception:
+        b2_client.abort_multipart_upload(Bucket=dest_bucket, Key=dest_key, UploadId=upload_id)
+        raise
+    if checksums:
+        # A multipart ETag is the MD5 of the part MD5s followed by the part count
+        check_etag(response, f"{hashlib.md5(b''.join(part_digests)).hexdigest()}-{len(part_digests)}")
+
+class CompressionRules:
+    """
+    Picks the codec for an object: skip-listed extensions and content types are
+    never compressed, then the first of a bucket rule, an extension rule, a
+    content-type prefix rule or the default applies. "none" disables compression
+    and "zstd" falls back to "gzip" when the zstandard module is not installed.
+    """
+
+    def __init__(self, config):
+        self.default = config.get('default', 'gzip')
+        self.buckets = config.get('buckets', {})
+        self.extensions = config.get('extensions', {})
+        self.content_types = config.get('content_types', {})
+        self.skip = SKIP_COMPRESSION + tuple(config.get('skip', []))
+
+    def codec_for(self, bucket_name, key, content_type):
+        key = key.lower()
+        content_type = (content_type or '').lower()
+        if any(key.endswith(rule) or content_type.startswith(rule) for rule in self.skip):
+            return None
+        codec = self.buckets.get(bucket_name)
+        if codec is None:
+            codec = next((value for rule, value in self.extensions.items() if key.endswith(rule.lower())), None)
+        if codec is None:
+            codec = next((value for rule, value in self.content_types.items() if content_type.startswith(rule.lower())), None)
+        if codec is None:
+            codec = self.default
+        if codec == 'zstd' and zstandard is None:
+            codec = 'gzip'
+        return None if codec == 'none' else codec
+
+def compress_chunks(chunks, codec):
+    if codec == 'zstd':
+        compressor = zstandard.ZstdCompressor().compressobj()
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 writes a gzip container
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+def compression_metadata(metadata, codec, size):
+    return dict(metadata, **{'compression': codec, 'original-size': str(size)})
+
+def hashed(chunks, hasher):
+    for chunk in chunks:
+        hasher.update(chunk)
+        yield chunk
+
+def copy_object(s3_client, b2_client, bucket_name, obj, dest_bucket, dest_key, metadata, part_size, compression=None, hasher=None, checksums=None):
+    """
+    Stream the source body into B2 so memory stays bounded by the part size,
+    not the object size. Returns the source verification status when
+    checksums are given.
+    """
+    response = s3_client.get_object(Bucket=bucket_name, Key=obj['Key'])
+    body = response['Body']
+    try:
+        chunks = body.iter_chunks(READ_CHUNK)
+        for digest in (hasher, checksums):
+            if digest:
+                chunks = hashed(chunks, digest)
+        codec = compression.codec_for(bucket_name, obj['Key'], response.get('ContentType')) if compression else None
+        if codec:
+            chunks = compress_chunks(chunks, codec)
+            metadata = compression_metadata(metadata, codec, obj.get('Size', response.get('ContentLength')))
+        parts = iter_parts(chunks, part_size_for(obj.get('Size', 0), part_size))
+        upload_stream(b2_client, dest_bucket, dest_key, parts, metadata, checksums)
+    finally:
+        body.close()
+    return source_status(checksums, response) if checksums else None
+
+def list_objects(s3_client, bucket_name, start_after=None, end_key=None):
+    # Keys in (start_after, end_key]; either bound may be None
+    kwargs = {'StartAfter': start_after} if start_after else {}
+    for page in s3_client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name, **kwargs):
+        if 'Contents' not in page:
+            logger.info(f"No objects found in bucket {bucket_name}")
+            continue
+        for obj in page['Contents']:
+            if end_key is not None and obj['Key'] > end_key:
+                return
+            yield obj
+
+def parse_time(value):
+    # Inventory and event timestamps look like 2024-01-01T00:00:00.000Z
+    if value is None or hasattr(value, 'isoformat'):
+        return value
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+def split_s3_url(url):
+    bucket, _, key = url[len('s3://'):].partition('/')
+    return bucket, key
+
+def call_started(context, **kwargs):
+    context['started'] = time.time()
+
+def call_finished(model, parsed, context, **kwargs):
+    metrics = getattr(CALL_CONTEXT, 'metrics', None)
+    if metrics and 'started' in context:
+        retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+        metrics.record_call(CALL_CONTEXT.bucket, model.name, time.time() - context['started'], retries)
+
+def instrument(client):
+    # unique_id keeps clients reused by warm invocations from collecting duplicate hooks
+    client.meta.events.register('before-call.s3', call_started, unique_id='s3-to-backblaze-call-started')
+    client.meta.events.register('after-call.s3', call_finished, unique_id='s3-to-backblaze-call-finished')
+    return client
+
+class SourceClients:
+    """
+    S3 clients for source buckets. Each bucket's region is looked up once with
+    get_bucket_location and its objects are listed and read through a client
+    for that region, so no request goes through a cross-region redirect.
+    Buckets whose region cannot be looked up use the default client, which is
+    remembered like a region.
+    """
+
+    def __init__(self, default_client, max_pool_connections):
+        self.default_client = default_client
+        self.max_pool_connections = max_pool_connections
+
+    def region(self, bucket_name):
+        region = BUCKET_REGIONS.get(bucket_name)
+        if region is None:
+            try:
+                location = self.default_client.get_bucket_location(Bucket=bucket_name).get('LocationConstraint')
+            except ClientError as e:
+                logger.warning(f"Could not get the region of bucket {bucket_name}, using the default client: {str(e)}")
+                location = UNKNOWN_REGION
+            region = BUCKET_REGIONS[bucket_name] = LEGACY_REGIONS.get(location, location)
+        return None if region is UNKNOWN_REGION else region
+
+    def client(self, bucket_name):
+        region = self.region(bucket_name)
+        if region is None or region == self.default_client.meta.region_name:
+            return self.default_client
+        key = (region, self.max_pool_connections)
+        client = REGION_CLIENTS.get(key)
+        if client is None:
+            # Creating clients on the shared boto3 session is not thread-safe
+            with REGION_LOCK:
+                client = REGION_CLIENTS.get(key)
+                if client is None:
+                    logger.info(f"Creating S3 client for region {region}")
+                    client = REGION_CLIENTS[key] = instrument(boto3.client(
+                        's3',
+                        region_name=region,
+                        config=Config(max_pool_connections=self.max_pool_connections)
+                    ))
+        return client
+
+class InventorySource:
+    """
+    Lists one bucket from an S3 Inventory manifest (gzip'd CSV, or Parquet when
+    pyarrow is installed) instead of list_objects_v2. The manifest and data
+    files are read from S3 for s3:// locations, otherwise from local files
+    found relative to the manifest. Rows are parsed one
+    at a time, and the prefix, size and last-modified filters are applied
+    while parsing. Every object carries its position in the inventory so a
+    paused run resumes at the next row; rows are not in key order.
+    """
+
+    def __init__(self, source, location, filters):
+        # source(bucket) returns the S3 client for that bucket
+        self.source = source
+        self.location = location
+        self.manifest = json.load(self.open(location))
+        self.bucket = self.manifest['sourceBucket']
+        self.data_bucket = self.manifest.get('destinationBucket', '').split(':::')[-1]
+        self.format = self.manifest.get('fileFormat', 'CSV')
+        if self.format not in ('CSV', 'Parquet'):
+            raise ValueError(f"Unsupported inventory format {self.format} in {location}")
+        if self.format == 'Parquet' and pq is None:
+            raise ValueError(f"Parquet inventory {location} needs the pyarrow module")
+        self.prefix = filters.get('prefix', '')
+        self.min_size = filters.get('min_size')
+        self.max_size = filters.get('max_size')
+        self.modified_after = parse_time(filters.get('modified_after'))
+        self.modified_before = parse_time(filters.get('modified_before'))
+
+    def open(self, location):
+        if location.startswith('s3://'):
+            bucket, key = split_s3_url(location)
+            return self.source(bucket).get_object(Bucket=bucket, Key=key)['Body']
+        return open(location, 'rb')
+
+    def open_data(self, key):
+        if self.location.startswith('s3://'):
+            return self.open(f"s3://{self.data_bucket}/{key}")
+        # A local copy may keep the full key, or the data/ folder next to or above the manifest
+        root = os.path.dirname(self.location)
+        name = os.path.basename(key)
+        candidates = [os.path.join(root, key), os.path.join(root, 'data', name), os.path.join(root, '..', 'data', name), os.path.join(root, name)]
+        return open(next((path for path in candidates if os.path.exists(path)), candidates[-1]), 'rb')
+
+    def keep(self, size, last_modified):
+        if self.min_size is not None and size < self.min_size:
+            return False
+        if self.max_size is not None and size > self.max_size:
+            return False
+        if self.modified_after and last_modified is not None and last_modified <= self.modified_after:
+            return False
+        if self.modified_before and last_modified is not None and last_modified > self.modified_before:
+            return False
+        return True
+
+    def csv_rows(self, stream):
+        columns = [column.strip() for column in self.manifest['fileSchema'].split(',')]
+        key_at = columns.index('Key')
+        with gzip.GzipFile(fileobj=stream) as unzipped:
+            for row in csv.reader(io.TextIOWrapper(unzipped, encoding='utf-8', newline='')):
+                # Keys are URL-encoded in CSV inventories; check the prefix before parsing the rest
+                key = unquote_plus(row[key_at])
+                if not key.startswith(self.prefix):
+                    yield None
+                    continue
+                yield dict(zip(columns, row), Key=key)
+
+    def parquet_rows(self, stream):
+        names = {'key': 'Key', 'size': 'Size', 'last_modified_date': 'LastModifiedDate', 'e_tag': 'ETag',
+                 'is_latest': 'IsLatest', 'is_delete_marker': 'IsDeleteMarker'}
+        with tempfile.TemporaryFile() as f:
+            for chunk in iter(lambda: stream.read(READ_CHUNK), b''):
+                f.write(chunk)
+            parquet = pq.ParquetFile(f)
+            # Only the columns needed are decoded
+            columns = [name for name in names if name in parquet.schema_arrow.names]
+            for batch in parquet.iter_batches(columns=columns):
+                for row in batch.to_pylist():
+                    if not row['key'].startswith(self.prefix):
+                        yield None
+                        continue
+                    yield {names[name]: value for name, value in row.items()}
+
+    def objects(self, start_after=None):
+        # start_after is a "file:row" position handed out with an earlier object
+        first_file, first_row = map(int, start_after.split(':')) if start_after else (0, -1)
+        for file_index, data_file in enumerate(self.manifest['files']):
+            if file_index < first_file:
+                continue
+            stream = self.open_data(data_file['key'])
+            try:
+                rows = self.csv_rows(stream) if self.format == 'CSV' else self.parquet_rows(stream)
+                for row_index, row in enumerate(rows):
+                    if row is None or (file_index == first_file and row_index <= first_row):
+                        continue
+                    if str(row.get('IsLatest', 'true')).lower() == 'false' or str(row.get('IsDeleteMarker', 'false')).lower() == 'true':
+                        continue
+                    size = int(row.get('Size') or 0)
+                    last_modified = parse_time(row.get('LastModifiedDate'))
+                    if not self.keep(size, last_modified):
+                        continue
+                    yield {
+                        'Key': row['Key'],
+                        'Size': size,
+                        'ETag': f'"{row["ETag"]}"' if row.get('ETag') else None,
+                        'LastModified': last_modified,
+                        'InventoryPosition': f"{file_index}:{row_index}"
+                    }
+            finally:
+                stream.close()
+
+def run_workers(work, items, concurrency):
+    # Producer/consumer: items are read on the calling thread into a bounded queue
+    # drained by `concurrency` workers, so listing never runs far ahead of copying
+    if concurrency <= 1:
+        for item in items:
+            work(item)
+        return
+    tasks = queue.Queue(maxsize=concurrency * QUEUE_DEPTH)
+
+    def worker():
+        while True:
+            item = tasks.get()
+            if item is STOP:
+                return
+            work(item)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        for item in items:
+            tasks.put(item)
+    finally:
+        for _ in threads:
+            tasks.put(STOP)
+        for thread in threads:
+            thread.join()
+
+class TransferEstimate:
+    """
+    Estimates how long one worker takes to copy an object of a given size: a
+    per-object cost measured on objects smaller than a part, plus the size over
+    the per-worker throughput measured on larger ones.
+    """
+
+    def __init__(self, part_size):
+        self.part_size = part_size
+        self.lock = threading.Lock()
+        self.small = [0, 0.0]  # objects, seconds
+        self.large = [0, 0, 0.0]  # objects, bytes, seconds
+        self.started = 0
+
+    def record(self, size, seconds):
+        with self.lock:
+            if size < self.part_size:
+                self.small[0] += 1
+                self.small[1] += seconds
+            else:
+                self.large[0] += 1
+                self.large[1] += size
+                self.large[2] += seconds
+
+    def seconds(self, size, safety=ESTIMATE_SAFETY):
+        with self.lock:
+            overhead = self.small[1] / self.small[0] if self.small[0] else DEFAULT_OBJECT_SECONDS
+            count, total, seconds = self.large
+        rate = total / max(seconds - count * overhead, 0.001) if count else DEFAULT_WORKER_MBPS * 1024 * 1024
+        return (overhead + size / rate) * safety
+
+    def load(self, measured):
+        # Continuations carry what earlier invocations measured, so they do not start over from the guesses
+        with self.lock:
+            self.small = list(measured.get('small', self.small))
+            self.large = list(measured.get('large', self.large))
+
+    def to_dict(self):
+        with self.lock:
+            return {'small': list(self.small), 'large': list(self.large)}
+
+def run_scheduled(work, objects, concurrency, part_size, estimate, deadline):
+    """
+    Copy objects in two lanes that run side by side: multipart-sized objects,
+    largest first, on a quarter of the workers and the rest, smallest first, on
+    the others; a worker whose lane is empty helps the other one. An object is
+    only started if its estimate finishes before the deadline. Returns the
+    objects that would not, and apart from them the ones that would not finish
+    even within a whole invocation.
+    """
+    lanes = [
+        deque(sorted((obj for obj in objects if obj.get('Size', 0) >= part_size), key=lambda obj: obj['Size'], reverse=True)),
+        deque(sorted((obj for obj in objects if obj.get('Size', 0) < part_size), key=lambda obj: obj.get('Size', 0)))
+    ]
+    deferred = []
+    too_large = []
+    lock = threading.Lock()
+
+    def take(lane):
+        with lock:
+            for pending in (lanes[lane], lanes[1 - lane]):
+                while pending:
+                    obj = pending.popleft()
+                    seconds = estimate.seconds(obj.get('Size', 0))
+                    # Without the safety margin, as an object is only given up on when it clearly cannot fit
+                    fits_invocation = deadline.fits_invocation(estimate.seconds(obj.get('Size', 0), 1))
+                    # The first object of an invocation starts anyway, so every continuation makes progress,
+                    # unless no invocation could finish it; deferring that one would replay it forever
+                    if deadline.fits(seconds) or (not estimate.started and fits_invocation):
+                        estimate.started += 1
+                        return obj
+                    (deferred if fits_invocation else too_large).append(obj)
+        return None
+
+    def worker(lane):
+        while True:
+            obj = take(lane)
+            if obj is None:
+                return
+            started = time.time()
+            work(obj)
+            estimate.record(obj.get('Size', 0), time.time() - started)
+
+    if concurrency <= 1:
+        worker(0)
+        return deferred, too_large
+    large_workers = max(1, concurrency // 4)
+    threads = [threading.Thread(target=worker, args=(0 if index < large_workers else 1,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return deferred, too_large
+
+def object_version(obj):
+    # What the manifest compares to decide whether an object changed since the last run
+    last_modified = obj.get('LastModified')
+    if hasattr(last_modified, 'isoformat'):
+        last_modified = last_modified.isoformat()
+    return [obj.get('ETag'), obj.get('Size'), last_modified]
+
+def continuation_object(obj):
+    # Deferred objects keep what the manifest needs, in a form the continuation can carry as JSON
+    etag, size, last_modified = object_version(obj)
+    return {'Key': obj['Key'], 'Size': size, 'ETag': etag, 'LastModified': last_modified}
+
+def encode_manifest(manifest):
+    return gzip.compress(json.dumps(manifest, separators=(',', ':')).encode('utf-8'))
+
+class LocalManifestStore:
+    def __init__(self, path):
+        self.path = path
+
+    def load(self, bucket_name, name='latest'):
+        try:
+            with gzip.open(os.path.join(self.path, bucket_name, f"{name}.json.gz")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save(self, bucket_name, names, manifest):
+        os.makedirs(os.path.join(self.path, bucket_name), exist_ok=True)
+        body = encode_manifest(manifest)
+        for name in names:
+            with open(os.path.join(self.path, bucket_name, f"{name}.json.gz"), 'wb') as f:
+                f.write(body)
+
+class B2ManifestStore:
+    # Manifests live next to the backups as {bucket}/manifests/{timestamp}.json.gz
+    def __init__(self, b2_client, dest_bucket):
+        self.b2_client = b2_client
+        self.dest_bucket = dest_bucket
+
+    def load(self, bucket_name, name='latest'):
+        try:
+            body = self.b2_client.get_object(Bucket=self.dest_bucket, Key=f"{bucket_name}/manifests/{name}.json.gz")['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}
+            raise
+        return json.loads(gzip.decompress(body))
+
+    def save(self, bucket_name, names, manifest):
+        body = encode_manifest(manifest)
+        for name in names:
+            self.b2_client.put_object(Bucket=self.dest_bucket, Key=f"{bucket_name}/manifests/{name}.json.gz", Body=body, ContentType='application/json', ContentEncoding='gzip')
+
+class ContentStore:
+    """
+    Content-addressed bodies stored once under cas/sha256/{aa}/{digest} in the
+    destination bucket. The index of known digests, and of source fingerprints
+    (ETag and size) already hashed, is cached in a local file and in B2, so
+    known content needs neither a source read nor a HEAD request.
+    """
+
+    def __init__(self, b2_client, dest_bucket, cache_path=DEFAULT_CAS_CACHE):
+        self.b2_client = b2_client
+        self.dest_bucket = dest_bucket
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        index = self.load_local() or self.load_remote()
+        self.digests = set(index.get('digests', []))
+        self.fingerprints = index.get('fingerprints', {})
+
+    def load_local(self):
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def load_remote(self):
+        try:
+            body = self.b2_client.get_object(Bucket=self.dest_bucket, Key=CAS_INDEX_KEY)['Body'].read()
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return {}
+            raise
+        return json.loads(gzip.decompress(body))
+
+    def save(self):
+        # Merge what other workers saved meanwhile; a lost race only costs a HEAD later
+        remote = self.load_remote()
+        with self.lock:
+            self.digests.update(remote.get('digests', []))
+            self.fingerprints = dict(remote.get('fingerprints', {}), **self.fingerprints)
+            index = {'digests': sorted(self.digests), 'fingerprints': self.fingerprints}
+        body = json.dumps(index, separators=(',', ':'))
+        # Shards running in this process save at the same time, so each writes its own temporary file
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(os.path.abspath(self.cache_path)), delete=False) as f:
+            f.write(body)
+        os.replace(f.name, self.cache_path)
+        self.b2_client.put_object(Bucket=self.dest_bucket, Key=CAS_INDEX_KEY, Body=gzip.compress(body.encode('utf-8')), ContentType='application/json', ContentEncoding='gzip')
+
+    @staticmethod
+    def key(digest):
+        return f"cas/sha256/{digest[:2]}/{digest}"
+
+    @staticmethod
+    def fingerprint(obj):
+        return f"{obj['ETag']}:{obj.get('Size')}" if obj.get('ETag') else None
+
+    def known_digest(self, obj):
+        # Digest of content hashed on an earlier run, if it is still stored
+        digest = self.fingerprints.get(self.fingerprint(obj))
+        return digest if digest in self.digests else None
+
+    def has(self, digest):
+        if digest in self.digests:
+            return True
+        try:
+            self.b2_client.head_object(Bucket=self.dest_bucket, Key=self.key(digest))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404', 'NotFound'):
+                return False
+            raise
+        self.add(digest)
+        return True
+
+    def add(self, digest, obj=None):
+        with self.lock:
+            self.digests.add(digest)
+            if obj and self.fingerprint(obj):
+                self.fingerprints[self.fingerprint(obj)] = digest
+
+def percentiles(values):
+    values = sorted(values)
+    return {f"p{p}": round(values[min(len(values) - 1, len(values) * p // 100)], 1) for p in LATENCY_PERCENTILES} if values else {}
+
+class TransferMetrics:
+    """
+    Objects, bytes, time, GET/PUT latencies, retries and errors per bucket for
+    one invocation. Latencies and retries come from the client call hooks:
+    GetObject is timed to the response headers, PutObject and UploadPart to
+    the end of the upload. emit() prints them as CloudWatch Embedded Metric
+    Format lines, one per bucket and one for the run.
+    """
+
+    def __init__(self, namespace=DEFAULT_METRICS_NAMESPACE):
+        self.namespace = namespace
+        self.started = time.time()
+        self.lock = threading.Lock()
+        # None collects calls made outside of any bucket, like list_buckets
+        self.buckets = {}
+
+    def stats(self, bucket_name):
+        return self.buckets.setdefault(bucket_name, {'objects': 0, 'bytes': 0, 'deduplicated': 0, 'seconds': 0.0, 'get_ms': [], 'put_ms': [], 'retries': 0, 'errors': 0})
+
+    def record_call(self, bucket_name, operation, seconds, retries):
+        with self.lock:
+            stats = self.stats(bucket_name)
+            stats['retries'] += retries
+            if operation == 'GetObject':
+                stats['get_ms'].append(seconds * 1000)
+            elif operation in PUT_OPERATIONS:
+                stats['put_ms'].append(seconds * 1000)
+
+    def record_object(self, bucket_name, size, deduplicated=False):
+        # Objects whose content was already stored transfer nothing, so they stay out of the rates
+        with self.lock:
+            stats = self.stats(bucket_name)
+            if deduplicated:
+                stats['deduplicated'] += 1
+            else:
+                stats['objects'] += 1
+                stats['bytes'] += size
+
+    def record_errors(self, bucket_name, count=1):
+        with self.lock:
+            self.stats(bucket_name)['errors'] += count
+
+    def record_time(self, bucket_name, seconds):
+        with self.lock:
+            self.stats(bucket_name)['seconds'] += seconds
+
+    @staticmethod
+    def summary(stats):
+        seconds = max(stats['seconds'], 0.001)
+        return {
+            'objects': stats['objects'],
+            'bytes': stats['bytes'],
+            'seconds': round(stats['seconds'], 3),
+            'objects_per_second': round(stats['objects'] / seconds, 2),
+            'mb_per_second': round(stats['bytes'] / 1024 / 1024 / seconds, 2),
+            'deduplicated': stats['deduplicated'],
+            'get_latency_ms': percentiles(stats['get_ms']),
+            'put_latency_ms': percentiles(stats['put_ms']),
+            'retries': stats['retries'],
+            'errors': stats['errors']
+        }
+
+    def summaries(self):
+        with self.lock:
+            run = {'objects': 0, 'bytes': 0, 'deduplicated': 0, 'seconds': time.time() - self.started, 'get_ms': [], 'put_ms': [], 'retries': 0, 'errors': 0}
+            for stats in self.buckets.values():
+                for name in ('objects', 'bytes', 'deduplicated', 'retries', 'errors', 'get_ms', 'put_ms'):
+                    run[name] += stats[name]
+            buckets = {bucket_name: self.summary(stats) for bucket_name, stats in self.buckets.items() if bucket_name is not None}
+        return self.summary(run), buckets
+
+    def emf(self, summary, dimensions):
+        metrics = {
+            'ObjectsCopied': (summary['objects'], 'Count'),
+            'BytesCopied': (summary['bytes'], 'Bytes'),
+            'ObjectsPerSecond': (summary['objects_per_second'], 'Count/Second'),
+            'MegabytesPerSecond': (summary['mb_per_second'], 'Megabytes/Second'),
+            'ObjectsDeduplicated': (summary['deduplicated'], 'Count'),
+            'Retries': (summary['retries'], 'Count'),
+            'Errors': (summary['errors'], 'Count')
+        }
+        for kind, name in (('get_latency_ms', 'GetLatency'), ('put_latency_ms', 'PutLatency')):
+            for percentile, value in summary[kind].items():
+                metrics[f"{name}{percentile.upper()}"] = (value, 'Milliseconds')
+        return dict(
+            {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': self.namespace,
+                        'Dimensions': [list(dimensions)],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, (_, unit) in metrics.items()]
+                    }]
+                }
+            },
+            **dimensions,
+            **{name: value for name, (value, _) in metrics.items()}
+        )
+
+    def emit(self):
+        # EMF lines must be bare JSON, so they bypass the logger's prefix
+        run, buckets = self.summaries()
+        for bucket_name, summary in buckets.items():
+            print(json.dumps(self.emf(summary, {'Bucket': bucket_name})), flush=True)
+        print(json.dumps(self.emf(run, {})), flush=True)
+        return {'run': run, 'buckets': buckets}
+
+def merge_metrics(total, summary):
+    # Shard summaries only add up as counts; their rates and latency percentiles stay in the shards' own EMF lines
+    for bucket_name, stats in summary.get('buckets', {}).items():
+        bucket = total.setdefault(bucket_name, {'objects': 0, 'bytes': 0, 'deduplicated': 0, 'retries': 0, 'errors': 0})
+        for name in bucket:
+            bucket[name] += stats[name]
+    return total
+
+def merge_too_large(total, too_large):
+    for bucket_name, keys in too_large.items():
+        total.setdefault(bucket_name, []).extend(keys)
+    return total
+
+def merge_verification(total, summary):
+    for bucket_name, counts in summary.items():
+        merged = total.setdefault(bucket_name, {'verified': 0, 'unverifiable': 0, 'mismatched': 0, 'mismatched_keys': []})
+        for status in ('verified', 'unverifiable', 'mismatched'):
+            merged[status] += counts.get(status, 0)
+        merged['mismatched_keys'] = (merged['mismatched_keys'] + counts.get('mismatched_keys', []))[:MAX_MISMATCHED_KEYS]
+    return total
+
+def get_manifest_store(config, b2_client, dest_bucket):
+    if config.get('path'):
+        return LocalManifestStore(config['path'])
+    return B2ManifestStore(b2_client, dest_bucket)
+
+class Deadline:
+    # Lambda context is optional so the engine also runs offline without a time limit;
+    # shard workers also get the coordinator's end time, which may come first
+    def __init__(self, context, margin_seconds, end_epoch_ms=None):
+        self.context = context
+        self.margin_ms = margin_seconds * 1000
+        self.end_epoch_ms = end_epoch_ms
+        # What a fresh invocation gets, to tell objects that will never fit from ones that just wait
+        self.invocation_ms = context.get_remaining_time_in_millis() if context else None
+
+    def remaining_ms(self):
+        remaining = [self.context.get_remaining_time_in_millis()] if self.context else []
+        if self.end_epoch_ms:
+            remaining.append(self.end_epoch_ms - time.time() * 1000)
+        return min(remaining) if remaining else None
+
+    def epoch_ms(self):
+        remaining = self.remaining_ms()
+        return None if remaining is None else int(time.time() * 1000 + remaining)
+
+    def expired(self):
+        remaining = self.remaining_ms()
+        return remaining is not None and remaining < self.margin_ms
+
+    def fits(self, seconds):
+        remaining = self.remaining_ms()
+        return remaining is None or remaining - self.margin_ms >= seconds * 1000
+
+    def fits_invocation(self, seconds):
+        return self.invocation_ms is None or self.invocation_ms - self.margin_ms >= seconds * 1000
+
+class Bundle:
+    """
+    An in-memory tar of small objects and its index of key -> [offset, length]
+    of each object's data, so one object can be restored with a ranged GET.
+    Compressed members add [codec, original size] to their index entry.
+    Source verification statuses wait in statuses until the bundle is uploaded.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.buffer = io.BytesIO()
+        self.tar = tarfile.open(fileobj=self.buffer, mode='w', format=tarfile.PAX_FORMAT)
+        self.index = {}
+        self.members = []
+        self.statuses = {}
+
+    def add(self, obj, data, extra=(), status=None):
+        info = tarfile.TarInfo(obj['Key'])
+        info.size = len(data)
+        info.mtime = time.time()
+        self.tar.addfile(info, io.BytesIO(data))
+        # The data ends padded to a whole block right where the tar stream is now
+        offset = self.buffer.tell() - -(-len(data) // TAR_BLOCK) * TAR_BLOCK
+        self.index[obj['Key']] = [offset, len(data)] + list(extra)
+        self.members.append(obj)
+        if status:
+            self.statuses[obj['Key']] = status
+
+    def size(self):
+        return self.buffer.tell()
+
+    def close(self):
+        self.tar.close()
+        return self.buffer.getvalue()
+
+class CopyEngine:
+    """
+    Copies listed objects to B2. With a manifest store, only objects whose
+    ETag, size or LastModified changed since the previous manifest are copied,
+    and every run saves a manifest of the whole bucket mapping each key to
+    [ETag, Size, LastModified, timestamp the object is stored under]; packed
+    objects add [bundle key, offset, length] to that.
+
+    Objects smaller than bundle_threshold are packed into tar bundles of about
+    bundle_size bytes, stored as {bucket}/bundles/{timestamp}/{name}.tar with a
+    {name}.index.json sidecar.
+
+    With a content store, bodies are stored once per SHA-256 and the manifest
+    entry records the content key instead; bundling does not apply then.
+
+    With verify, the MD5 of every object read is checked against its ETag where
+    the ETag is an MD5, uploads carry Content-MD5 and their B2 ETags are checked,
+    and the outcome is counted per bucket in self.verification.
+
+    With schedule, listed objects are copied size-sorted by run_scheduled and
+    the ones that would not finish before the deadline go into self.deferred,
+    or into self.too_large (keys only) if no invocation would be long enough.
+    """
+
+    def __init__(self, s3_client, b2_client, dest_bucket, timestamp, part_size, concurrency, manifest_store=None, deadline=None,
+                 bundle_threshold=0, bundle_size=DEFAULT_BUNDLE_SIZE_MB * 1024 * 1024, compression=None,
+                 incremental=True, content_store=None, verify=False, inventories=None, schedule=False, source_clients=None,
+                 metrics=None):
+        self.s3_client = s3_client
+        self.b2_client = b2_client
+        self.dest_bucket = dest_bucket
+        self.timestamp = timestamp
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.manifest_store = manifest_store
+        self.deadline = deadline or Deadline(None, 0)
+        self.bundle_threshold = bundle_threshold
+        self.bundle_size = bundle_size
+        self.compression = compression
+        self.incremental = incremental
+        self.content_store = content_store
+        self.deduplicated = 0
+        self.verify = verify
+        self.verification = {}
+        self.inventories = inventories or {}
+        self.source_clients = source_clients
+        self.metrics = metrics
+        self.estimate = TransferEstimate(part_size) if schedule else None
+        self.deferred = {}
+        self.too_large = {}
+        self.lock = threading.Lock()
+        self.copied = {}
+        self.skipped = {}
+        self.objects = {}
+        self.bundles = {}
+        self.bundle_count = 0
+        # Bundle names must not collide with those of other shard workers of the same run
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def source(self, bucket_name):
+        return self.source_clients.client(bucket_name) if self.source_clients else self.s3_client
+
+    def stored(self, bucket_name, obj, location=(), deduplicated=False):
+        if self.metrics:
+            self.metrics.record_object(bucket_name, obj.get('Size', 0), deduplicated)
+        with self.lock:
+            self.copied[bucket_name] += 1
+            copied_in_bucket = self.copied[bucket_name]
+            objects = self.objects.get(bucket_name)
+            if objects is not None:
+                objects[obj['Key']] = object_version(obj) + [self.timestamp] + list(location)
+        if copied_in_bucket % 100 == 0:
+            logger.info(f"Copied {copied_in_bucket} objects from {bucket_name} so far")
+
+    def checksums(self):
+        return Checksums() if self.verify else None
+
+    def record_check(self, bucket_name, status, key=None):
+        with self.lock:
+            merge_verification(self.verification, {bucket_name: {status: 1, 'mismatched_keys': [key] if key else []}})
+
+    def check_source(self, data, response):
+        # Verify bytes already in memory before anything is uploaded; the status is recorded
+        # by the caller once the upload went through, so a B2 mismatch does not count twice
+        if not self.verify:
+            return None, None
+        checksums = Checksums()
+        checksums.update(data)
+        return checksums, source_status(checksums, response)
+
+    def discard(self, dest_key):
+        try:
+            self.b2_client.delete_object(Bucket=self.dest_bucket, Key=dest_key)
+        except ClientError as e:
+            logger.error(f"Could not delete {dest_key} from {self.dest_bucket}: {str(e)}")
+
+    def copy_failed(self, bucket_name, key, error):
+        logger.error(f"Error copying object {key} from bucket {bucket_name}: {str(error)}")
+        if self.metrics:
+            self.metrics.record_errors(bucket_name)
+        if isinstance(error, ChecksumMismatch):
+            self.record_check(bucket_name, 'mismatched', key)
+
+    def copy(self, bucket_name, obj):
+        CALL_CONTEXT.metrics, CALL_CONTEXT.bucket = self.metrics, bucket_name
+        if self.content_store:
+            self.copy_deduplicated(bucket_name, obj)
+            return
+        if obj.get('Size', 0) < self.bundle_threshold:
+            self.pack(bucket_name, obj)
+            return
+        key = obj['Key']
+        dest_key = f"{bucket_name}/{self.timestamp}/{key}"
+        try:
+            status = copy_object(
+                self.source(bucket_name),
+                self.b2_client,
+                bucket_name,
+                obj,
+                self.dest_bucket,
+                dest_key,
+                {
+                    'original-bucket': bucket_name,
+                    'backup-timestamp': self.timestamp
+                },
+                self.part_size,
+                self.compression,
+                checksums=self.checksums()
+            )
+        except Exception as e:
+            self.copy_failed(bucket_name, key, e)
+            return
+        if status:
+            self.record_check(bucket_name, status)
+        self.stored(bucket_name, obj)
+
+    def copy_deduplicated(self, bucket_name, obj):
+        store = self.content_store
+        metadata = {
+            'original-bucket': bucket_name,
+            'backup-timestamp': self.timestamp
+        }
+        uploaded = None
+        status = None
+        try:
+            digest = store.known_digest(obj)
+            if digest is None and obj.get('Size', 0) <= self.part_size:
+                # Small objects are hashed in memory and uploaded from the same read
+                response = self.source(bucket_name).get_object(Bucket=bucket_name, Key=obj['Key'])
+                try:
+                    data = response['Body'].read()
+                finally:
+                    response['Body'].close()
+                checksums, status = self.check_source(data, response)
+                digest = hashlib.sha256(data).hexdigest()
+                known = store.has(digest)
+                if not known:
+                    chunks = [data]
+                    codec = self.compression.codec_for(bucket_name, obj['Key'], response.get('ContentType')) if self.compression else None
+                    if codec:
+                        chunks = compress_chunks(chunks, codec)
+                        metadata = compression_metadata(metadata, codec, len(data))
+                    uploaded = store.key(digest)
+                    upload_stream(self.b2_client, self.dest_bucket, store.key(digest), iter_parts(chunks, self.part_size), metadata, checksums)
+            elif digest is None:
+                # Large objects are hashed in a first streaming pass and only read again if new
+                hasher = hashlib.sha256()
+                checksums = self.checksums()
+                response = self.source(bucket_name).get_object(Bucket=bucket_name, Key=obj['Key'])
+                try:
+                    chunks = hashed(response['Body'].iter_chunks(READ_CHUNK), hasher)
+                    for _ in hashed(chunks, checksums) if checksums else chunks:
+                        pass
+                finally:
+                    response['Body'].close()
+                if checksums:
+                    status = source_status(checksums, response)
+                digest = hasher.hexdigest()
+                known = store.has(digest)
+                if not known:
+                    check = hashlib.sha256()
+                    uploaded = store.key(digest)
+                    copy_object(self.source(bucket_name), self.b2_client, bucket_name, obj, self.dest_bucket, store.key(digest), metadata, self.part_size, self.compression, check, self.checksums())
+                    if check.hexdigest() != digest:
+                        self.discard(uploaded)
+                        raise ValueError("object changed while it was being copied")
+            else:
+                known = True
+        except Exception as e:
+            if uploaded and isinstance(e, ChecksumMismatch):
+                # Left in place, the next run's HEAD would take the bad object as known content
+                self.discard(uploaded)
+            self.copy_failed(bucket_name, obj['Key'], e)
+            return
+        if status:
+            self.record_check(bucket_name, status)
+        store.add(digest, obj)
+        if known:
+            with self.lock:
+                self.deduplicated += 1
+        self.stored(bucket_name, obj, [store.key(digest)], known)
+
+    def pack(self, bucket_name, obj):
+        try:
+            response = self.source(bucket_name).get_object(Bucket=bucket_name, Key=obj['Key'])
+            try:
+                data = response['Body'].read()
+            finally:
+                response['Body'].close()
+            _, status = self.check_source(data, response)
+            codec = self.compression.codec_for(bucket_name, obj['Key'], response.get('ContentType')) if self.compression else None
+            extra = ()
+            if codec:
+                extra = (codec, len(data))
+                data = b''.join(compress_chunks([data], codec))
+        except Exception as e:
+            self.copy_failed(bucket_name, obj['Key'], e)
+            return
+        with self.lock:
+            bundle = self.bundles.get(bucket_name)
+            if bundle is None:
+                self.bundle_count += 1
+                bundle = self.bundles[bucket_name] = Bundle(f"{self.run_id}-{self.bundle_count:05d}")
+            bundle.add(obj, data, extra, status)
+            full = bundle.size() >= self.bundle_size
+            if full:
+                del self.bundles[bucket_name]
+        if full:
+            self.upload_bundle(bucket_name, bundle)
+
+    def upload_bundle(self, bucket_name, bundle):
+        body = bundle.close()
+        prefix = f"{bucket_name}/bundles/{self.timestamp}/{bundle.name}"
+        metadata = {
+            'original-bucket': bucket_name,
+            'backup-timestamp': self.timestamp
+        }
+        checksums = self.checksums()
+        if checksums:
+            checksums.update(body)
+        try:
+            upload_stream(self.b2_client, self.dest_bucket, f"{prefix}.tar", iter_parts([body], self.part_size), metadata, checksums)
+            self.b2_client.put_object(
+                Bucket=self.dest_bucket,
+                Key=f"{prefix}.index.json",
+                Body=json.dumps({'bundle': f"{prefix}.tar", 'objects': bundle.index}).encode('utf-8'),
+                ContentType='application/json',
+                Metadata=metadata
+            )
+        except Exception as e:
+            logger.error(f"Error uploading bundle {prefix}.tar with {len(bundle.members)} objects from bucket {bucket_name}: {str(e)}")
+            if self.metrics:
+                self.metrics.record_errors(bucket_name, len(bundle.members))
+            if isinstance(e, ChecksumMismatch):
+                for obj in bundle.members:
+                    self.record_check(bucket_name, 'mismatched', obj['Key'])
+            return
+        for obj in bundle.members:
+            if obj['Key'] in bundle.statuses:
+                self.record_check(bucket_name, bundle.statuses[obj['Key']])
+            self.stored(bucket_name, obj, [f"{prefix}.tar"] + bundle.index[obj['Key']])
+
+    def flush_bundle(self, bucket_name):
+        bundle = self.bundles.pop(bucket_name, None)
+        if bundle:
+            self.upload_bundle(bucket_name, bundle)
+
+    def unchanged(self, bucket_name, obj, previous, objects):
+        entry = previous.get(obj['Key'])
+        # A failed copy keeps pointing at the last good backup of the key, if any
+        if entry:
+            objects[obj['Key']] = entry
+        if entry and entry[:3] == object_version(obj):
+            with self.lock:
+                self.skipped[bucket_name] += 1
+            return True
+        return False
+
+    def schedule(self, bucket_name, listing, deferred, changed):
+        # Once a window defers objects the time is up, so no further window is listed
+        windows = chain([deferred], iter(lambda: list(islice(listing, SCHEDULE_WINDOW)), []))
+        for window in windows:
+            window = [obj for obj in window if changed(obj)]
+            left, too_large = run_scheduled(lambda obj: self.copy(bucket_name, obj), window, self.concurrency, self.part_size, self.estimate, self.deadline)
+            if too_large:
+                logger.warning(f"Skipping {len(too_large)} objects of {bucket_name} that would not finish within one invocation")
+                self.too_large.setdefault(bucket_name, []).extend(obj['Key'] for obj in too_large)
+            if left:
+                logger.info(f"Deferring {len(left)} objects of {bucket_name} that would not finish before the deadline")
+                return left
+        return []
+
+    def backup_bucket(self, bucket_name, start_after=None, end_key=None, shard=None, deferred=()):
+        """
+        Copy the bucket's objects listed after start_after, up to end_key. Returns
+        the last key handled ('' if none) when the deadline stops the listing
+        early, None when done. A shard of a bucket saves its manifest as
+        {timestamp}.shard-{shard} for the coordinator to merge.
+        Objects are handed to workers in listing order and every handed-out object
+        finishes before returning, so listing again after that key (or inventory
+        position) resumes exactly.
+        With a scheduler, objects deferred by the previous invocation are copied
+        first, and objects deferred now are left in self.deferred with the last
+        key listed returned.
+        """
+        CALL_CONTEXT.metrics, CALL_CONTEXT.bucket = self.metrics, bucket_name
+        self.copied.setdefault(bucket_name, 0)
+        self.skipped.setdefault(bucket_name, 0)
+        resume_after = None
+        last_key = start_after or ''
+
+        def until_deadline(listing):
+            nonlocal resume_after, last_key
+            for obj in listing:
+                if self.deadline.expired():
+                    resume_after = last_key
+                    return
+                last_key = obj.get('InventoryPosition', obj['Key'])
+                yield obj
+
+        if bucket_name in self.inventories:
+            listing = until_deadline(self.inventories[bucket_name].objects(start_after))
+        else:
+            listing = until_deadline(list_objects(self.source(bucket_name), bucket_name, start_after, end_key))
+        changed = lambda obj: True
+        if self.manifest_store:
+            name = self.timestamp if shard is None else f"{self.timestamp}.shard-{shard}"
+            previous = self.manifest_store.load(bucket_name).get('objects', {}) if self.incremental else {}
+            # A resumed bucket continues the manifest its earlier invocations left behind
+            objects = self.manifest_store.load(bucket_name, f"{name}.partial").get('objects', {}) if start_after is not None else {}
+            self.objects[bucket_name] = objects
+            changed = lambda obj: not self.unchanged(bucket_name, obj, previous, objects)
+
+        def copy_changed(obj):
+            if changed(obj):
+                self.copy(bucket_name, obj)
+
+        if self.estimate:
+            self.deferred[bucket_name] = self.schedule(bucket_name, listing, list(deferred), changed)
+            if self.deferred[bucket_name] and resume_after is None:
+                resume_after = last_key
+        else:
+            run_workers(copy_changed, listing, self.concurrency)
+        self.flush_bundle(bucket_name)
+        if not self.manifest_store:
+            return resume_after
+        manifest = {'bucket': bucket_name, 'timestamp': self.timestamp, 'objects': objects}
+        if resume_after is not None:
+            self.manifest_store.save(bucket_name, [f"{name}.partial"], manifest)
+        elif shard is None:
+            self.manifest_store.save(bucket_name, [name, 'latest'], manifest)
+        else:
+            self.manifest_store.save(bucket_name, [name], manifest)
+        return resume_after
+
+def merge_shard_manifests(manifest_store, bucket_name, timestamp, count):
+    objects = {}
+    for index in range(count):
+        objects.update(manifest_store.load(bucket_name, f"{timestamp}.shard-{index}").get('objects', {}))
+    manifest_store.save(bucket_name, [timestamp, 'latest'], {'bucket': bucket_name, 'timestamp': timestamp, 'objects': objects})
+
+def sample_key_counts(s3_client, bucket_name, max_calls):
+    """
+    Estimate how a bucket's keys spread over key ranges using at most max_calls
+    listing calls, breadth first from the empty prefix. Each prefix is listed page
+    by page and its keys grouped on their next character: a group that ends inside
+    a page is counted exactly, one that runs past the end of a page is skipped with
+    StartAfter and queued to be split the same way. Groups left unsplit are taken to
+    be as large as the split prefixes of the same length. Returns (position, count)
+    in key order, where a range runs from its position to the next one.
+    """
+    calls = 0
+    ranges = {}
+    expanded = []
+
+    def page(prefix, start_after=None, max_keys=PLAN_PAGE_KEYS):
+        nonlocal calls
+        calls += 1
+        kwargs = {'StartAfter': start_after} if start_after else {}
+        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=prefix, MaxKeys=max_keys, **kwargs)
+        return [obj['Key'] for obj in response.get('Contents', [])], response.get('IsTruncated', False)
+
+    pending = deque([''])
+    while pending and calls < max_calls:
+        prefix = pending.popleft()
+        ranges.pop(prefix, None)
+        expanded.append(prefix)
+        keys, truncated = page(prefix)
+        # Keys sharing a long prefix (dates, paths) would otherwise cost a few calls per character
+        common = os.path.commonprefix([keys[0], keys[-1]]) if keys else prefix
+        while truncated and len(common) > len(prefix) + 1 and calls < max_calls:
+            after, _ = page(prefix, common + LAST_KEY_CHAR, 1)
+            if not after:
+                prefix = common
+                break
+            common = os.path.commonprefix([common, after[0]])
+        while keys:
+            groups = Counter(key[:len(prefix) + 1] for key in keys)
+            last = max(groups)
+            for group, count in groups.items():
+                ranges[group] = (count, group != last or not truncated)
+            if not truncated:
+                break
+            pending.append(last)
+            if calls >= max_calls:
+                # Whatever is left of the prefix after this group has not been looked at
+                ranges[last + LAST_KEY_CHAR] = (0, False)
+                break
+            keys, truncated = page(prefix, last + LAST_KEY_CHAR)
+
+    counts = {position: count for position, (count, _) in ranges.items()}
+    # Deepest first, as the size of a split prefix includes the estimates below it
+    unsplit = {position: len(position.rstrip(LAST_KEY_CHAR)) for position, (_, exact) in ranges.items() if not exact}
+    for depth in sorted(set(unsplit.values()), reverse=True):
+        sizes = [sum(count for position, count in counts.items() if position.startswith(name))
+                 for name in expanded if len(name) == depth]
+        sizes = sizes or [count for position, (count, exact) in ranges.items() if exact and len(position) == depth]
+        typical = sum(sizes) // len(sizes) if sizes else PLAN_PAGE_KEYS
+        for position, depth_of in unsplit.items():
+            if depth_of == depth:
+                counts[position] = max(counts[position], typical)
+    return sorted(counts.items())
+
+def plan_shards(source, bucket_names, shards_per_bucket):
+    """
+    Split each bucket into up to shards_per_bucket key ranges (start_after, end_key]
+    holding about the same number of keys, as estimated by sample_key_counts with a
+    few listing calls per shard. source(bucket) returns the S3 client for that bucket.
+    """
+    def plan(bucket_name):
+        bounds = []
+        if shards_per_bucket > 1:
+            sampled = sample_key_counts(source(bucket_name), bucket_name, PLAN_CALLS_PER_SHARD * shards_per_bucket)
+            total = sum(count for _, count in sampled)
+            seen = 0
+            for position, count in sampled:
+                # A range starting past the next cut point opens a new shard
+                if seen and seen * shards_per_bucket >= total * (len(bounds) + 1):
+                    bounds.append(position)
+                seen += count
+        bounds = [None] + bounds + [None]
+        count = len(bounds) - 1
+        return [{
+            'bucket': bucket_name,
+            'index': index,
+            'count': count,
+            'start_after': bounds[index],
+            'end_key': bounds[index + 1]
+        } for index in range(count)]
+
+    with ThreadPoolExecutor(max_workers=PLAN_WORKERS) as pool:
+        return [shard for shards in pool.map(plan, bucket_names) for shard in shards]
+
+def run_backup(engine, bucket_names, continuation, incremental, shard=None):
+    # Back up the buckets in order, or one key range of a bucket for a shard worker.
+    # Resume by bucket name, falling back to the index if the bucket is gone
+    first_bucket = continuation.get('bucket_index', 0)
+    start_after = continuation.get('start_after', (shard or {}).get('start_after'))
+    deferred = continuation.get('deferred', [])
+    copied_in_bucket = continuation.get('copied_in_bucket', 0)
+    unchanged_in_bucket = continuation.get('unchanged_in_bucket', 0)
+    if continuation.get('bucket') in bucket_names:
+        first_bucket = bucket_names.index(continuation['bucket'])
+        engine.copied[continuation['bucket']] = copied_in_bucket
+        engine.skipped[continuation['bucket']] = unchanged_in_bucket
+    elif continuation.get('bucket'):
+        # The paused bucket is gone: its copies stay counted, and the bucket now at its index starts over
+        start_after = (shard or {}).get('start_after')
+        deferred = []
+        copied_in_bucket = unchanged_in_bucket = 0
+    end_key = (shard or {}).get('end_key')
+    shard_index = shard['index'] if shard and shard['count'] > 1 else None
+    total_copied = continuation.get('total_objects_copied', 0) - copied_in_bucket
+    total_unchanged = continuation.get('total_objects_unchanged', 0) - unchanged_in_bucket
+    engine.deduplicated = continuation.get('total_objects_deduplicated', 0)
+    merge_verification(engine.verification, continuation.get('verification', {}))
+    merge_too_large(engine.too_large, continuation.get('too_large', {}))
+    if engine.estimate and continuation.get('estimate'):
+        engine.estimate.load(continuation['estimate'])
+    paused = None
+    
+    for index in range(first_bucket, len(bucket_names)):
+        bucket_name = bucket_names[index]
+        if start_after is None and engine.deadline.expired():
+            paused = {'bucket_index': index, 'bucket': bucket_name}
+            break
+        logger.info(f"Backing up bucket: {bucket_name}")
+        started = time.time()
+        resume_after = engine.backup_bucket(bucket_name, start_after, end_key, shard_index, deferred)
+        if engine.metrics:
+            engine.metrics.record_time(bucket_name, time.time() - started)
+        start_after = None
+        deferred = []
+        copied_in_bucket = engine.copied[bucket_name]
+        total_copied += copied_in_bucket
+        total_unchanged += engine.skipped[bucket_name]
+        if resume_after is not None:
+            logger.info(f"Pausing bucket {bucket_name} after {resume_after!r}: {copied_in_bucket} objects copied so far")
+            paused = {
+                'bucket_index': index,
+                'bucket': bucket_name,
+                'start_after': resume_after,
+                'copied_in_bucket': copied_in_bucket,
+                'unchanged_in_bucket': engine.skipped[bucket_name]
+            }
+            if engine.deferred.get(bucket_name):
+                paused['deferred'] = [continuation_object(obj) for obj in engine.deferred[bucket_name]]
+            break
+        logger.info(f"Completed bucket {bucket_name} backup: {copied_in_bucket} objects copied, {engine.skipped[bucket_name]} unchanged")
+
+    body = {
+        'message': f'Backup completed for {len(bucket_names)} buckets to {engine.dest_bucket}',
+        'total_objects_copied': total_copied,
+        'destination_bucket': engine.dest_bucket,
+        'complete': paused is None
+    }
+    if incremental:
+        body['total_objects_unchanged'] = total_unchanged
+    if engine.content_store:
+        body['total_objects_deduplicated'] = engine.deduplicated
+        engine.content_store.save()
+    if engine.verify:
+        body['verification'] = engine.verification
+    if engine.too_large:
+        body['too_large'] = engine.too_large
+    if engine.metrics:
+        body['metrics'] = engine.metrics.emit()
+    if paused:
+        paused.update(
+            timestamp=engine.timestamp,
+            total_objects_copied=total_copied,
+            total_objects_unchanged=total_unchanged,
+            total_objects_deduplicated=engine.deduplicated,
+            verification=engine.verification,
+            too_large=engine.too_large
+        )
+        if engine.estimate:
+            paused['estimate'] = engine.estimate.to_dict()
+        body['message'] = f"Backup paused at bucket {paused['bucket']} ({paused['bucket_index'] + 1} of {len(bucket_names)}) before the deadline, call again with continuation to resume"
+        body['continuation'] = paused
+        logger.info(f"Backup paused. Total objects copied so far: {total_copied}")
+    else:
+        logger.info(f"Backup completed. Total objects copied: {total_copied}")
+
+    return body
+
+def get_shard_invoker(event, context):
+    # The local executor runs shards as threads of this invocation, standing in for Lambda workers
+    if event.get('executor') == 'local':
+        return lambda shard_event: json.loads(lambda_handler(shard_event, context)['body'])
+    lambda_client = boto3.client(
+        'lambda',
+        config=Config(read_timeout=900, retries={'max_attempts': 0}, max_pool_connections=max(10, int(event.get('max_workers', 8))))
+    )
+    function_name = event.get('worker_function') or context.function_name
+
+    def invoke(shard_event):
+        response = lambda_client.invoke(FunctionName=function_name, Payload=json.dumps(shard_event).encode('utf-8'))
+        payload = json.loads(response['Payload'].read())
+        if response.get('FunctionError'):
+            raise RuntimeError(payload.get('errorMessage', str(payload)))
+        return json.loads(payload['body'])
+    return invoke
+
+def coordinate_backup(engine, event, bucket_names, invoke):
+    """
+    Split the buckets into shards, run them on up to max_workers parallel worker
+    invocations and add up their results. A shard that pauses at its deadline is
+    dispatched again while time is left, otherwise it goes into the continuation.
+    """
+    continuation = event.get('continuation') or {}
+    shards = continuation.get('shards') or plan_shards(engine.source, bucket_names, int(event.get('shards_per_bucket', 1)))
+    worker_event = {key: value for key, value in event.items() if key not in COORDINATOR_KEYS}
+    total_copied = continuation.get('total_objects_copied', 0)
+    total_unchanged = continuation.get('total_objects_unchanged', 0)
+    total_deduplicated = continuation.get('total_objects_deduplicated', 0)
+    verification = merge_verification({}, continuation.get('verification', {}))
+    too_large = merge_too_large({}, continuation.get('too_large', {}))
+    failed = list(continuation.get('failed_shards', []))
+    bucket_metrics = {}
+    # A bucket's shard manifests are merged once none of its shards is left or failed
+    remaining = Counter(shard['bucket'] for shard in shards + failed)
+    pending = []
+
+    def dispatch(pool, shard):
+        shard_event = dict(
+            worker_event,
+            shard={key: shard[key] for key in SHARD_KEYS},
+            continuation=dict(shard.get('continuation', {}), timestamp=engine.timestamp),
+            deadline_epoch_ms=engine.deadline.epoch_ms()
+        )
+        return pool.submit(invoke, shard_event)
+
+    with ThreadPoolExecutor(max_workers=max(1, int(event.get('max_workers', 8)))) as pool:
+        futures = {}
+        for shard in shards:
+            if engine.deadline.expired():
+                pending.append(shard)
+            else:
+                futures[dispatch(pool, shard)] = shard
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                shard = futures.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Error in shard {shard['index'] + 1} of {shard['count']} of bucket {shard['bucket']}: {str(e)}")
+                    failed.append({key: shard[key] for key in SHARD_KEYS})
+                    continue
+                total_copied += result['total_objects_copied']
+                total_unchanged += result.get('total_objects_unchanged', 0)
+                total_deduplicated += result.get('total_objects_deduplicated', 0)
+                merge_verification(verification, result.get('verification', {}))
+                merge_too_large(too_large, result.get('too_large', {}))
+                merge_metrics(bucket_metrics, result.get('metrics', {}))
+                if not result['complete']:
+                    # Its counts are already added up here, so the worker resumes counting from zero
+                    shard = dict(shard, continuation=dict(
+                        result['continuation'],
+                        total_objects_copied=0,
+                        total_objects_unchanged=0,
+                        total_objects_deduplicated=0,
+                        verification={},
+                        too_large={},
+                        copied_in_bucket=0,
+                        unchanged_in_bucket=0
+                    ))
+                    if engine.deadline.expired():
+                        pending.append(shard)
+                    else:
+                        futures[dispatch(pool, shard)] = shard
+                    continue
+                remaining[shard['bucket']] -= 1
+                if not remaining[shard['bucket']] and engine.manifest_store and shard['count'] > 1:
+                    merge_shard_manifests(engine.manifest_store, shard['bucket'], engine.timestamp, shard['count'])
+
+    body = {
+        'message': f'Backup completed for {len(bucket_names)} buckets to {engine.dest_bucket}',
+        'total_objects_copied': total_copied,
+        'destination_bucket': engine.dest_bucket,
+        'complete': not pending,
+        'shards': len(shards)
+    }
+    if event.get('incremental'):
+        body['total_objects_unchanged'] = total_unchanged
+    if event.get('dedup'):
+        body['total_objects_deduplicated'] = total_deduplicated
+    if event.get('verify'):
+        body['verification'] = verification
+    if event.get('metrics'):
+        run = {name: sum(stats[name] for stats in bucket_metrics.values()) for name in ('objects', 'bytes', 'deduplicated', 'retries', 'errors')}
+        body['metrics'] = {'run': run, 'buckets': bucket_metrics}
+    if too_large:
+        body['too_large'] = too_large
+    if failed:
+        body['failed_shards'] = failed
+    if pending:
+        body['message'] = f"Backup paused with {len(pending)} of {len(shards)} shards left before the deadline, call again with continuation to resume"
+        body['continuation'] = {
+            'timestamp': engine.timestamp,
+            'shards': pending,
+            'failed_shards': failed,
+            'total_objects_copied': total_copied,
+            'total_objects_unchanged': total_unchanged,
+            'total_objects_deduplicated': total_deduplicated,
+            'verification': verification,
+            'too_large': too_large
+        }
+    logger.info(f"Fan-out finished {len(shards) - len(pending) - len(failed)} shards, {len(pending)} left. Total objects copied: {total_copied}")
+    return body
+
 def lambda_handler(event, context):
     
     """
@@ -16,8 +1606,77 @@ def lambda_handler(event, context):
       "backblaze_key": "BACKBLAZESECRETKEY",
       "backblaze_endpoint": "s3.REGION.backblazeb2.com",
       "dest_bucket": "BACKBLAZEBUCKET",
-      "exclude_buckets": ["temp-bucket", "logs"]
+      "exclude_buckets": ["temp-bucket", "logs"],
+      "part_size_mb": 16,
+      "concurrency": 16,
+      "incremental": true,
+      "manifest": {"path": "/tmp/manifests"},
+      "deadline_margin_seconds": 15,
+      "continuation": null,
+      "fan_out": true,
+      "shards_per_bucket": 4,
+      "max_workers": 8,
+      "executor": "lambda",
+      "bundle_threshold_kb": 64,
+      "bundle_size_mb": 16,
+      "compression": {"default": "gzip", "buckets": {"media": "none"}, "extensions": {".log": "zstd"}, "skip": [".bin"]},
+      "dedup": {"cache_path": "/tmp/s3-to-backblaze-cas-index.json"},
+      "verify": true,
+      "inventory": {"manifests": ["s3://INVENTORYBUCKET/path/manifest.json"], "prefix": "", "min_size": 0, "max_size": null, "modified_after": null, "modified_before": null},
+      "schedule": true,
+      "metrics": {"namespace": "S3ToBackblaze"}
     }
+
+    With incremental, only new or changed objects are copied and a manifest
+    of the whole bucket is saved under manifest.path, or in dest_bucket as
+    {bucket}/manifests/{timestamp}.json.gz when no path is given.
+
+    When the remaining Lambda time drops below deadline_margin_seconds, the
+    run stops handing out objects, lets in-flight copies finish and returns
+    "complete": false with a continuation. Calling again with the same input
+    plus that continuation resumes under the same backup timestamp.
+
+    With fan_out, this invocation only coordinates: each bucket is split into
+    up to shards_per_bucket key ranges and every shard is sent to a worker
+    invocation of this function (worker_function, default itself), at most
+    max_workers at a time. executor "local" runs the shards in-process instead.
+
+    With bundle_threshold_kb, objects smaller than that are packed into tar
+    bundles of about bundle_size_mb, each with a JSON index of key -> [offset,
+    length] for restoring a single object with a ranged GET.
+
+    With compression, objects are gzip or zstd compressed on the way to B2 per
+    CompressionRules, and the codec and original size go into the metadata.
+
+    With dedup (true or a dict), bodies are stored once under cas/sha256/ and
+    each run's manifest maps keys to them; content already stored is not
+    uploaded again.
+
+    With verify, checksums are computed on the bytes as they stream through,
+    compared with the source ETag and B2's ETags, and summed up per bucket in
+    "verification"; objects that fail a check are not counted as copied.
+
+    With inventory, buckets that have an S3 Inventory manifest (s3:// URL or
+    local path) are listed from it instead of list_objects_v2, keeping only
+    keys under prefix, sizes within [min_size, max_size] and LastModified in
+    (modified_after, modified_before].
+
+    With schedule, listed objects are sorted by size and copied in two lanes
+    at once, large multipart objects largest first and small ones smallest
+    first. Copy times are estimated from the throughput measured so far, and
+    objects that would not finish before the deadline are returned in the
+    continuation's "deferred" list and copied first on the next call. Objects
+    that would not finish within a whole invocation are skipped and listed by
+    bucket in "too_large".
+
+    Every bucket is listed and read through an S3 client for its own region,
+    looked up with get_bucket_location and cached while the Lambda stays warm.
+
+    With metrics (true or a dict), objects, bytes, objects/s, MB/s, GET and PUT
+    latency percentiles, retries, errors and deduplicated objects (which are not
+    counted as transferred) are printed per bucket and for the
+    invocation as CloudWatch Embedded Metric Format lines under namespace, and
+    returned in "metrics". A fan_out coordinator adds up its shards' counts.
     """
     
     # Extract parameters from the event
@@ -26,78 +1685,89 @@ def lambda_handler(event, context):
     backblaze_endpoint = event.get('backblaze_endpoint')
     dest_bucket = event.get('dest_bucket')
     exclude_buckets = event.get('exclude_buckets', [])
+    part_size = int(float(event.get('part_size_mb', DEFAULT_PART_SIZE_MB)) * 1024 * 1024)
+    concurrency = max(1, int(event.get('concurrency', 1)))
+    incremental = event.get('incremental', False)
+    bundle_threshold = int(float(event.get('bundle_threshold_kb', 0)) * 1024)
+    bundle_size = int(float(event.get('bundle_size_mb', DEFAULT_BUNDLE_SIZE_MB)) * 1024 * 1024)
+    compression = CompressionRules(event['compression']) if event.get('compression') else None
+    dedup = event.get('dedup')
+    verify = event.get('verify', False)
+    inventory = event.get('inventory') or {}
+    schedule = event.get('schedule', False)
+    metrics_config = event.get('metrics')
+    continuation = event.get('continuation') or {}
+    deadline = Deadline(context, float(event.get('deadline_margin_seconds', DEFAULT_DEADLINE_MARGIN_SECONDS)), event.get('deadline_epoch_ms'))
     
     # Validate required parameters
     if not backblaze_key_id or not backblaze_key or not backblaze_endpoint or not dest_bucket:
         raise ValueError("Missing required parameters: backblaze_key_id, backblaze_key, backblaze_endpoint, dest_bucket")
+    if part_size < MIN_PART_SIZE:
+        raise ValueError("part_size_mb must be at least 5")
+    if inventory and (event.get('fan_out') or event.get('shard')):
+        raise ValueError("inventory listing cannot be combined with fan_out, its rows are not in key order")
     
     logger.info(f"Starting backup to destination bucket: {dest_bucket}")
     
-    s3_client = boto3.client('s3')
+    # Every worker holds one connection to each side, so size the pools to match
+    client_config = Config(max_pool_connections=max(10, concurrency))
+    s3_client = instrument(boto3.client('s3', config=client_config))
+    # Buckets outside the default region are read through a client for their own region
+    source_clients = SourceClients(s3_client, max(10, concurrency))
     
     # Backblaze B2 S3-compatible client
-    b2_client = boto3.client(
+    b2_client = instrument(boto3.client(
         's3',
         endpoint_url=f"https://{backblaze_endpoint}",
         aws_access_key_id=backblaze_key_id,
         aws_secret_access_key=backblaze_key,
-        region_name='us-west-004'
-    )
+        region_name='us-west-004',
+        config=client_config
+    ))
     
-    # Get list of all buckets, excluding if requested
-    all_buckets_resp = s3_client.list_buckets()
-    bucket_names = [b['Name'] for b in all_buckets_resp['Buckets'] if b['Name'] not in exclude_buckets]
+    if event.get('shard'):
+        # Shard workers only handle the bucket the coordinator gave them
+        bucket_names = [event['shard']['bucket']]
+    else:
+        # Get list of all buckets, excluding if requested
+        all_buckets_resp = s3_client.list_buckets()
+        bucket_names = [b['Name'] for b in all_buckets_resp['Buckets'] if b['Name'] not in exclude_buckets]
     
-    timestamp = datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
+    timestamp = continuation.get('timestamp') or datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
     
-    total_copied = 0
+    inventories = {}
+    for location in inventory.get('manifests', []):
+        source = InventorySource(source_clients.client, location, inventory)
+        inventories[source.bucket] = source
     
-    for bucket_name in bucket_names:
-        logger.info(f"Backing up bucket: {bucket_name}")
-        paginator = s3_client.get_paginator('list_objects_v2')
-        page_iterator = paginator.paginate(Bucket=bucket_name)
-
-        copied_in_bucket = 0
-
-        for page in page_iterator:
-            if 'Contents' not in page:
-                logger.info(f"No objects found in bucket {bucket_name}")
-                continue
-
-            for obj in page['Contents']:
-                key = obj['Key']
-                source = {'Bucket': bucket_name, 'Key': key}
-                dest_key = f"{bucket_name}/{timestamp}/{key}"
-                try:
-                    # Download the object content from source S3
-                    obj_body = s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
-                    # Upload to Backblaze B2 bucket
-                    b2_client.put_object(
-                        Bucket=dest_bucket,
-                        Key=dest_key,
-                        Body=obj_body,
-                        Metadata={
-                            'original-bucket': bucket_name,
-                            'backup-timestamp': timestamp
-                        }
-                    )
-                    copied_in_bucket += 1
-                    total_copied += 1
-                    if copied_in_bucket % 100 == 0:
-                        logger.info(f"Copied {copied_in_bucket} objects from {bucket_name} so far")
-                except Exception as e:
-                    logger.error(f"Error copying object {key} from bucket {bucket_name}: {str(e)}")
-                    continue
-
-        logger.info(f"Completed bucket {bucket_name} backup: {copied_in_bucket} objects copied")
-
-    logger.info(f"Backup completed. Total objects copied: {total_copied}")
+    # Deduplicated backups are only reachable through their manifests, so they always write one
+    manifest_store = get_manifest_store(event.get('manifest', {}), b2_client, dest_bucket) if incremental or dedup else None
+    content_store = None
+    if dedup and not event.get('fan_out'):
+        content_store = ContentStore(b2_client, dest_bucket, dedup.get('cache_path', DEFAULT_CAS_CACHE) if isinstance(dedup, dict) else DEFAULT_CAS_CACHE)
+    metrics = None
+    if metrics_config:
+        metrics = TransferMetrics(metrics_config.get('namespace', DEFAULT_METRICS_NAMESPACE) if isinstance(metrics_config, dict) else DEFAULT_METRICS_NAMESPACE)
+    engine = CopyEngine(
+        s3_client, b2_client, dest_bucket, timestamp, part_size, concurrency, manifest_store, deadline,
+        bundle_threshold=bundle_threshold,
+        bundle_size=bundle_size,
+        compression=compression,
+        incremental=incremental,
+        content_store=content_store,
+        verify=verify,
+        inventories=inventories,
+        schedule=schedule,
+        source_clients=source_clients,
+        metrics=metrics
+    )
+    
+    if event.get('fan_out'):
+        body = coordinate_backup(engine, event, bucket_names, get_shard_invoker(event, context))
+    else:
+        body = run_backup(engine, bucket_names, continuation, incremental, event.get('shard'))
 
     return {
         'statusCode': 200,
-        'body': json.dumps({
-            'message': f'Backup completed for {len(bucket_names)} buckets to {dest_bucket}',
-            'total_objects_copied': total_copied,
-            'destination_bucket': dest_bucket
-        })
+        'body': json.dumps(body)
     }
@@ -1,4 +1,7 @@
 import boto3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # SKU mappings per region with new large instance types added
 SKU_MAP = {
@@ -30,6 +33,51 @@ SKU_MAP = {
 
 ROUTE53_SKU = "AROUTE53ZONE"
 
+ROUTE53_TAG_BATCH = 10  # ListTagsForResources accepts up to 10 hosted zones per request
+ROUTE53_REQUESTS_PER_SECOND = 5  # Route 53 API limit per account
+
+class RateLimiter:
+    # Spaces calls evenly so concurrent workers stay under a requests-per-second limit
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+ROUTE53_LIMITER = RateLimiter(ROUTE53_REQUESTS_PER_SECOND)
+
+def load_hosted_zone_tags(route53, zone_filter=None):
+    """
+    Paginates every hosted zone and reads their tags 10 zones per
+    ListTagsForResources call, running the batches concurrently within the
+    Route 53 rate limit. Returns the zones and a zone id -> tags mapping.
+    """
+    zones = []
+    paginator = route53.get_paginator('list_hosted_zones')
+    for page in paginator.paginate():
+        zones.extend(zone for zone in page['HostedZones'] if not zone_filter or zone_filter(zone))
+        ROUTE53_LIMITER.wait()
+    zone_ids = [zone['Id'].split('/')[-1] for zone in zones]
+    batches = [zone_ids[start:start + ROUTE53_TAG_BATCH] for start in range(0, len(zone_ids), ROUTE53_TAG_BATCH)]
+
+    def fetch_tags(batch):
+        ROUTE53_LIMITER.wait()
+        return route53.list_tags_for_resources(ResourceType='hostedzone', ResourceIds=batch)['ResourceTagSets']
+
+    zone_tags = {}
+    with ThreadPoolExecutor(max_workers=ROUTE53_REQUESTS_PER_SECOND) as pool:
+        for tag_sets in pool.map(fetch_tags, batches):
+            for tag_set in tag_sets:
+                zone_tags[tag_set['ResourceId']] = tag_set.get('Tags', [])
+    return zones, zone_tags
+
 def lambda_handler(event, context):
     tenant_zone_count = {}
     tenant_zone_names = {}
@@ -39,12 +87,11 @@ def lambda_handler(event, context):
     route53 = boto3.client('route53')
 
     # Route 53 processing
-    hosted_zones = route53.list_hosted_zones()['HostedZones']
+    hosted_zones, zone_tags = load_hosted_zone_tags(route53)
     for zone in hosted_zones:
         zone_id = zone['Id'].split('/')[-1]
-        tags_response = route53.list_tags_for_resource(ResourceType='hostedzone', ResourceId=zone_id)
         tenant_tag = None
-        for tag in tags_response.get('ResourceTagSet', {}).get('Tags', []):
+        for tag in zone_tags.get(zone_id, []):
             if tag['Key'] == 'Tenant':
                 tenant_tag = tag['Value']
                 break
@@ -1,13 +1,19 @@
 import boto3
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import json
 
+# Fields describe_backup_job can fill in when a list_backup_jobs entry lacks them. BackupType (VSS only)
+# and BytesTransferred are optional in both responses, so they are reported as listed
+DESCRIBE_FIELDS = ('StatusMessage', 'IamRoleArn')
+DESCRIBE_WORKERS = 8
+
 def lambda_handler(event, context):
     client = boto3.client('backup')
     days = 1  # Set search day for alert return
     time_cutoff = datetime.utcnow() - timedelta(days=days)
     statuses = ['FAILED', 'EXPIRED']
-    failed_or_expired_jobs = []
+    jobs = []
 
     for status in statuses:
         next_token = None
@@ -21,29 +27,37 @@ def lambda_handler(event, context):
                 params['NextToken'] = next_token
 
             response = client.list_backup_jobs(**params)
-
-            for job in response.get('BackupJobs', []):
-                # Use DescribeBackupJob to pull additional information of backup jobs
-                job_details = client.describe_backup_job(
-                    BackupJobId=job.get('BackupJobId')
-                )
-                failed_or_expired_jobs.append({
-                    'BackupJobId': job.get('BackupJobId'),
-                    'ResourceArn': job.get('ResourceArn'),
-                    'BackupVaultName': job.get('BackupVaultName'),
-                    'CreatedAt': job.get('CreationDate').isoformat(),
-                    'Status': job.get('State'),
-                    'StatusMessage': job_details.get('StatusMessage'),
-                    'CompletionDate': job.get('CompletionDate').isoformat() if job.get('CompletionDate') else None,
-                    'BackupType': job_details.get('BackupType'),
-                    'BytesTransferred': job_details.get('BytesTransferred'),
-                    'IAMRoleArn': job_details.get('IamRoleArn')
-                })
+            jobs.extend(response.get('BackupJobs', []))
 
             next_token = response.get('NextToken')
             if not next_token:
                 break
 
+    def details(job):
+        # The list page already carries these fields, so DescribeBackupJob is only needed for gaps
+        if all(job.get(field) is not None for field in DESCRIBE_FIELDS):
+            return job
+        described = client.describe_backup_job(BackupJobId=job.get('BackupJobId'))
+        return dict(job, **{field: described.get(field) for field in DESCRIBE_FIELDS if job.get(field) is None})
+
+    with ThreadPoolExecutor(max_workers=DESCRIBE_WORKERS) as pool:
+        job_details = list(pool.map(details, jobs))
+
+    failed_or_expired_jobs = []
+    for job, detail in zip(jobs, job_details):
+        failed_or_expired_jobs.append({
+            'BackupJobId': job.get('BackupJobId'),
+            'ResourceArn': job.get('ResourceArn'),
+            'BackupVaultName': job.get('BackupVaultName'),
+            'CreatedAt': job.get('CreationDate').isoformat(),
+            'Status': job.get('State'),
+            'StatusMessage': detail.get('StatusMessage'),
+            'CompletionDate': job.get('CompletionDate').isoformat() if job.get('CompletionDate') else None,
+            'BackupType': detail.get('BackupType'),
+            'BytesTransferred': detail.get('BytesTransferred'),
+            'IAMRoleArn': detail.get('IamRoleArn')
+        })
+
     return {
         'statusCode': 200,
         'body': json.dumps(failed_or_expired_jobs)
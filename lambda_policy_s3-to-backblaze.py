@@ -20,6 +20,13 @@
                 "arn:aws:s3:::*",
                 "arn:aws:s3:::*/*"
             ]
+        },
+        {
+            "Effect": "Allow",
+            "Action": [
+                "lambda:InvokeFunction"
+            ],
+            "Resource": "arn:aws:lambda:REGION:ACCOUNT_ID:function:WORKER_FUNCTION"
         }
     ]
 }